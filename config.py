@@ -1,8 +1,16 @@
 # config.py
 import os
+import tempfile
+
+from dotenv import load_dotenv
+from sqlalchemy.pool import StaticPool
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
+# The settings below are read from the environment when this module is
+# imported, so .env has to be loaded first
+load_dotenv(os.path.join(basedir, ".env"))
+
 
 class Config:
     """Base configuration class. Contains default and common settings."""
@@ -17,12 +25,22 @@ class Config:
     APP_TITLE = PRODUCT_NAME
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_POOL_RECYCLE = 299
+    # Flask-SQLAlchemy 3 ignores SQLALCHEMY_POOL_RECYCLE; pool settings go here
+    SQLALCHEMY_ENGINE_OPTIONS = {"pool_recycle": 299}
 
     EMAIL = os.environ.get("ADMIN_EMAIL") or "example@gmail.com"
     MAIL_SUBJECT_PREFIX = f"[{PRODUCT_NAME}] "
     MAIL_SENDER = f"{PRODUCT_NAME} Admin <{EMAIL}>"
-    ADMINS = (os.environ.get("ADMINS") or EMAIL).split(",")
+    # Parsed once into a lowercased set so membership checks don't re-split
+    # the env string. Only explicitly configured addresses are admins; the
+    # placeholder EMAIL above never is.
+    ADMINS = frozenset(
+        address.strip().lower()
+        for address in (
+            os.environ.get("ADMINS") or os.environ.get("ADMIN_EMAIL") or ""
+        ).split(",")
+        if address.strip()
+    )
 
     # --- Email Configuration ---
     # Set to 'true' in your .env file for production to enable real emails.
@@ -45,6 +63,48 @@ class Config:
 
     WTF_CSRF_ENABLED = True
 
+    # werkzeug generate_password_hash method; create_app expands it to the
+    # full spelling werkzeug stores (so "scrypt" works too). Verification
+    # reads the method stored in each hash, so changing it doesn't invalidate
+    # old passwords; with REHASH on, they are upgraded and committed on the
+    # next successful login. Use `flask calibrate-password-hash` to pick a
+    # cost for the host.
+    PASSWORD_HASH_METHOD = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_HASH_REHASH = True
+
+    # --- Rate limiting ---
+    # Per-client quotas are kept in Redis when available so all workers share
+    # them; the in-memory fallback is per process.
+    RATELIMIT_STORAGE_URI = os.environ.get("REDIS_URL", "memory://")
+    # If that Redis is unreachable, keep limiting per process in memory (and
+    # never fail the request) rather than turning a cache outage into an
+    # API outage
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True
+    RATELIMIT_SWALLOW_ERRORS = True
+    RATELIMIT_HEADERS_ENABLED = True
+
+    # Number of reverse proxies in front of the app whose X-Forwarded-For
+    # header can be trusted (0 disables it).
+    TRUSTED_PROXIES = int(os.environ.get("TRUSTED_PROXIES", 0))
+
+    # --- Population data ---
+    # Optional path to a local WorldPop GeoTIFF. When set (and rasterio is
+    # installed), small impact circles are summed locally instead of calling
+    # the WorldPop API.
+    LOCAL_WP_TIF = os.environ.get("LOCAL_WP_TIF")
+
+    # --- Upstream APIs ---
+    # Without a key NASA's shared, heavily rate-limited DEMO_KEY is used.
+    NASA_API_KEY = os.environ.get("NASA_API_KEY") or "DEMO_KEY"
+    WORLDPOP_BASE = os.environ.get(
+        "WORLDPOP_BASE", "https://api.worldpop.org/v1/services/stats"
+    )
+    WORLDPOP_DATASET = os.environ.get("WORLDPOP_DATASET", "wpgppop")
+    WORLDPOP_YEAR = os.environ.get("WORLDPOP_YEAR", "2020")
+    NOMINATIM_BASE = os.environ.get(
+        "NOMINATIM_BASE", "https://nominatim.openstreetmap.org/reverse"
+    )
+
     @staticmethod
     def init_app(app):
         """Hook for additional app initializations."""
@@ -75,24 +135,56 @@ class TestingConfig(Config):
 
     # Use an in-memory SQLite database for tests to keep them fast and isolated
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    # Every connection to :memory: gets its own empty database, so share one
+    # connection across threads to keep the tables made by db.create_all()
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": StaticPool,
+        "connect_args": {"check_same_thread": False},
+    }
 
     # CSRF protection is often disabled during tests for convenience
     WTF_CSRF_ENABLED = False
 
+    # A deliberately slow KDF only makes every test that sets a password slow
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1"
+
     # Disable caching for tests
     CACHE_TYPE = "NullCache"
 
+    # Tests hit the same endpoints many times from one address
+    RATELIMIT_ENABLED = False
+
 
 class ProductionConfig(Config):
     """Configuration for production."""
 
     # Ensure DEBUG is explicitly False in production
     DEBUG = False
-
-    CACHE_TYPE = "SimpleCache"
+    # Templates don't change on a deployed host; skip the mtime checks
+    TEMPLATES_AUTO_RELOAD = False
+
+    # SimpleCache is per-process, so every gunicorn worker would keep its own
+    # copy. Share one cache across workers: Redis when REDIS_URL is set,
+    # otherwise a filesystem cache all workers on the host can read.
+    CACHE_REDIS_URL = os.environ.get("REDIS_URL")
+    CACHE_TYPE = "RedisCache" if CACHE_REDIS_URL else "FileSystemCache"
+    # Defaults to a directory the app can always create, so a host without
+    # /var/cache permissions still boots; set CACHE_DIR for a persistent one
+    CACHE_DIR = os.environ.get("CACHE_DIR") or os.path.join(
+        tempfile.gettempdir(), "asteroid_cache"
+    )
+    CACHE_DEFAULT_TIMEOUT = 3600
 
     # Database URI must be set in the environment for production
     SQLALCHEMY_DATABASE_URI = os.environ.get("DATABASE_URL")
+    # Keep warm connections for the gthread workers and drop dead ones
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": 10,
+        "max_overflow": 20,
+        "pool_timeout": 30,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    }
 
 
 # A dictionary to easily select the correct config class
@@ -1,25 +1,75 @@
 from flask import Blueprint, request, jsonify, current_app
-from datetime import datetime, date
+from datetime import date
+from typing import Annotated
 import os
+import functools
+import hashlib
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import math
+import threading
 import time
+from bisect import bisect_right
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import diskcache
+import ijson
+import numpy as np
+import orjson
 
 from spectree import SpecTree, Response
-from pydantic import BaseModel, Field
+from pydantic import (
+    AliasChoices,
+    BaseModel,
+    BeforeValidator,
+    Field,
+    model_validator,
+)
+
+from factory import api, cache, db, limiter
+
+
+def _parse_iso_date(value):
+    """
+    Parse a strict YYYY-MM-DD date, raising ValueError otherwise.
 
-from factory import api, cache, db
+    pydantic's lax date parsing would also take numbers (as Unix timestamps)
+    and datetimes, and date.fromisoformat (fast, implemented in C) takes
+    compact and week dates since Python 3.11, so the shape is checked first.
+    """
+    if isinstance(value, date):
+        return value
+    if (
+        not isinstance(value, str)
+        or len(value) != 10
+        or value[4] != "-"
+        or value[7] != "-"
+    ):
+        raise ValueError(f"Invalid isoformat string: {value!r}")
+    return date.fromisoformat(value)
+
+
+IsoDate = Annotated[date, BeforeValidator(_parse_iso_date)]
 
 
 class AsteroidRequest(BaseModel):
-    start_date: str = Field(
-        ..., example="2025-10-05", description="Start date (YYYY-MM-DD)"
+    start_date: IsoDate | None = Field(
+        None, example="2025-10-05", description="Start date (YYYY-MM-DD)"
     )
-    end_date: str | None = Field(
+    end_date: IsoDate | None = Field(
         None, example="2025-10-05", description="End date (YYYY-MM-DD)"
     )
 
+    @model_validator(mode="after")
+    def check_date_range(self):
+        if self.end_date is not None:
+            if self.start_date is None:
+                raise ValueError("end_date requires start_date")
+            if self.end_date < self.start_date:
+                raise ValueError("end_date cannot be before start_date.")
+        return self
+
 
 class AsteroidItem(BaseModel):
     id: str
@@ -36,6 +86,55 @@ class ErrorResponse(BaseModel):
     details: str | None = None
 
 
+class ImpactLocation(BaseModel):
+    lat: float = Field(..., example=40.7128)
+    lon: float = Field(..., example=-74.006)
+    radius_km: float = Field(5.0, example=12, description="Impact radius (km)")
+
+
+class ImpactOrbitalData(BaseModel):
+    aphelion_distance: float = Field(..., example=1.5, description="Aphelion (AU)")
+
+
+class ImpactAsteroid(BaseModel):
+    orbital_data: ImpactOrbitalData
+    diameterMeters: float = Field(..., example=120)
+    mass_kg: float | None = None
+    relative_velocity_km_s: float | None = None
+    entry_speed_km_s: float | None = None
+    impact_energy_tnt: float | None = None
+    # NASA's close approach entries, as sent by the frontend
+    close_approach_data: list[dict] | None = Field(
+        None, validation_alias=AliasChoices("close_approach_data", "closeApproachData")
+    )
+
+
+class SimulateImpactRequest(BaseModel):
+    geojson: dict | None = None
+    location: ImpactLocation | None = None
+    asteroid: ImpactAsteroid
+
+    @model_validator(mode="after")
+    def check_area(self):
+        if not self.geojson and self.location is None:
+            raise ValueError("either geojson or location required")
+        return self
+
+
+class UpstreamError(Exception):
+    """
+    An upstream service failed; carries the JSON error body and status, and
+    whether the failure is transient (timeouts, connection errors, 5xx, 429)
+    and so worth retrying soon.
+    """
+
+    def __init__(self, payload, status, transient=False):
+        super().__init__(payload.get("error") or payload.get("message"))
+        self.payload = payload
+        self.status = status
+        self.transient = transient
+
+
 # class AsteroidInfo(BaseModel):
 #     diameter: float
 #     mass: float
@@ -45,29 +144,203 @@ class ErrorResponse(BaseModel):
 
 
 asteroid_blueprint = Blueprint("asteroid_controller", __name__, url_prefix="/asteroid")
+# Registered by factory.register_blueprints
+blueprint = asteroid_blueprint
+
+# One pooled session for every outbound call (NASA, WorldPop, Nominatim) so
+# repeated requests reuse keep-alive connections instead of a new TLS handshake.
+# Each upstream host gets its own pool, sized for the request threads plus the
+# background executor all talking to the same host at once.
+# Connection failures and 502/503/504 answers are retried, but read timeouts
+# are not: each retry would wait out the whole timeout again (60 s for the
+# WorldPop stats call) and blow through callers' own deadlines.
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=64,
+    max_retries=Retry(
+        total=3,
+        read=False,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+    ),
+)
+_SESSION.mount("https://", _adapter)
+_SESSION.mount("http://", _adapter)
+
+# Cached upstream answers are refreshed after their fresh TTL but kept until
+# their max TTL, so an outage can be bridged with a stale copy flagged by
+# this Warning header
+STALE_WARNING = '110 - "Response is Stale"'
+# Feeds for past days are settled; one that includes today still changes
+FEED_PAST_TTL = 86400
+FEED_RECENT_TTL = 600
+FEED_MAX_TTL = 7 * 86400
+# Individual NEO lookups rarely change
+NEO_LOOKUP_TTL = 86400
+
+# Upstream calls currently in flight, keyed by what they fetch (see _coalesce)
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _coalesce(key, fn, *args):
+    """
+    Call fn(*args) at most once at a time per key.
+
+    Concurrent callers asking for the same key while a call is in flight wait
+    for that call and share its result (or exception) instead of issuing a
+    duplicate upstream request.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _inflight[key] = future
+
+    if not is_owner:
+        return future.result()
+
+    try:
+        result = fn(*args)
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _cache_get(key):
+    """
+    Read from the shared cache, treating a backend failure (e.g. Redis down)
+    as a miss so the request falls through to the upstream call.
+    """
+    try:
+        return cache.get(key)
+    except Exception:
+        current_app.logger.warning("Cache read failed for %s", key, exc_info=True)
+        return None
+
+
+def _cache_set(key, value, timeout):
+    """Write to the shared cache, skipping the write if the backend fails."""
+    try:
+        cache.set(key, value, timeout=timeout)
+    except Exception:
+        current_app.logger.warning("Cache write failed for %s", key, exc_info=True)
+
+
+def _feed_fresh_ttl(end_date, today):
+    """How long a cached feed ending on the ISO end_date stays fresh as of today."""
+    if end_date >= today.isoformat():
+        return FEED_RECENT_TTL
+    return FEED_PAST_TTL
+
+
+def _fetch_feed(start_date, end_date, today):
+    """
+    Fetch the NASA NEO feed for an ISO date range and return a
+    (serialized /feed response body, is_stale) tuple.
+
+    Feed data for a given range barely changes, so the result is cached per
+    (start_date, end_date) to spare the upstream round-trip and the DEMO_KEY
+    rate limit. Caching the final bytes means a hit also skips parsing,
+    flattening and re-encoding. Concurrent misses for the same range share a
+    single upstream call.
+
+    Entries are fresh for _feed_fresh_ttl(end_date, today); after that they are
+    refetched, but kept until FEED_MAX_TTL so a stale copy can be served if
+    NASA fails. Errors propagate when there is nothing to fall back on.
+    """
+    key = f"neo:feed:{start_date}:{end_date}"
+    entry = _cache_get(key)
+    if entry is not None and time.time() - entry[0] < _feed_fresh_ttl(end_date, today):
+        return entry[1], False
+
+    try:
+        body = _coalesce(
+            ("feed", start_date, end_date), _request_feed, start_date, end_date
+        )
+    except (requests.exceptions.RequestException, ValueError):
+        if entry is None:
+            raise
+        current_app.logger.warning("NASA NEO feed unavailable; serving stale copy")
+        return entry[1], True
+
+    _cache_set(key, (time.time(), body), timeout=FEED_MAX_TTL)
+    return body, False
+
+
+def _request_feed(start_date, end_date):
+    """Call the NASA NEO feed and build the /feed response body."""
+    nasa_url = "https://api.nasa.gov/neo/rest/v1/feed"
+    params = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "api_key": current_app.config["NASA_API_KEY"],
+    }
+
+    # Multi-day feeds run to megabytes, so the body is streamed and parsed
+    # one day at a time instead of materializing NASA's whole document
+    with _SESSION.get(nasa_url, params=params, timeout=10, stream=True) as resp:
+        resp.raise_for_status()
+        if "application/json" not in resp.headers.get("content-type", ""):
+            raise ValueError("Upstream did not return JSON")
+        # Let urllib3 undo any gzip/deflate transfer encoding
+        raw = resp.raw
+        raw.decode_content = True
+
+        # Build list of simple asteroid objects (id, name, distance). Direct
+        # indexing is much cheaper than defaulted .get chains per row; a feed
+        # that doesn't have the documented shape is treated as bad upstream
+        # data.
+        try:
+            formatted_asteroids = [
+                {
+                    "id": a["id"],
+                    "name": a["name"],
+                    "distance": a["close_approach_data"][0]["miss_distance"][
+                        "kilometers"
+                    ],
+                }
+                for _day, asteroids in ijson.kvitems(
+                    raw, "near_earth_objects", use_float=True
+                )
+                for a in asteroids
+            ]
+        except ijson.JSONError as exc:
+            raise ValueError(f"Invalid JSON from upstream: {exc}") from exc
+        except (KeyError, IndexError, TypeError) as exc:
+            current_app.logger.exception("Unexpected NASA NEO feed shape")
+            raise ValueError("Unexpected NEO feed shape") from exc
+
+    return orjson.dumps({"asteroids": formatted_asteroids})
 
 
 @asteroid_blueprint.route("/feed", methods=["GET"])
+# Conditional requests answered with 304 are cheap and don't use up quota
+@limiter.limit("60/minute", deduct_when=lambda response: response.status_code != 304)
 @api.validate(
     query=AsteroidRequest,
     resp=Response(HTTP_200=AsteroidFeedResponse),
     tags=["asteroid"],
 )
 def feed():
-    start_date = request.args.get("start_date")
-    end_date = request.args.get("end_date", start_date)
-
-    if not start_date:
-        start_date = date.today().isoformat()
-        end_date = start_date
-
-    try:
-        sd = datetime.strptime(start_date, "%Y-%m-%d").date()
-        ed = datetime.strptime(end_date, "%Y-%m-%d").date()
-    except ValueError:
-        return jsonify({"message": "Invalid date format. Use YYYY-MM-DD."}), 400
-
+    # Dates were already parsed (YYYY-MM-DD only) and the range checked by
+    # the query model
+    query = request.context.query
     today = date.today()
+    if query.start_date is None:
+        sd = ed = today
+    else:
+        sd = query.start_date
+        ed = query.end_date or sd
+
     if sd > today or ed > today:
         return (
             jsonify(
@@ -77,26 +350,9 @@ def feed():
             ),
             400,
         )
-    if ed < sd:
-        return jsonify({"message": "end_date cannot be before start_date."}), 400
-
-    nasa_key = os.getenv("NASA_API_KEY") or "DEMO_KEY"
-    if nasa_key == "DEMO_KEY":
-        current_app.logger.warning(
-            "NASA_API_KEY not set; using DEMO_KEY (rate-limited)."
-        )
-
-    nasa_url = "https://api.nasa.gov/neo/rest/v1/feed"
-    params = {
-        "start_date": sd.isoformat(),
-        "end_date": ed.isoformat(),
-        "api_key": nasa_key,
-    }
 
     try:
-        resp = requests.get(nasa_url, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
+        body, is_stale = _fetch_feed(sd.isoformat(), ed.isoformat(), today)
     except requests.exceptions.RequestException as exc:
         current_app.logger.exception("Error fetching data from NASA NEO feed")
         return (
@@ -114,23 +370,16 @@ def feed():
             502,
         )
 
-    near_earth_objects = data.get("near_earth_objects", {})
-
-    # Build list of simple asteroid objects (id, name, date)
-    formatted_asteroids = []
-    for date_str, asteroids in near_earth_objects.items():
-        for asteroid in asteroids:
-            formatted_asteroids.append(
-                {
-                    "id": asteroid.get("id"),
-                    "name": asteroid.get("name"),
-                    "distance": asteroid.get("close_approach_data", [{}])[0]
-                    .get("miss_distance", {})
-                    .get("kilometers", 0.0),
-                }
-            )
+    response = current_app.response_class(body, mimetype="application/json")
 
-    return jsonify({"asteroids": formatted_asteroids}), 200
+    # Weak validator over the payload so browsers/CDNs can revalidate with
+    # If-None-Match and get an empty 304 instead of the full document
+    response.set_etag(hashlib.blake2b(body, digest_size=16).hexdigest(), weak=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = _feed_fresh_ttl(ed.isoformat(), today)
+    if is_stale:
+        response.headers["Warning"] = STALE_WARNING
+    return response.make_conditional(request)
 
 
 @asteroid_blueprint.route("/get_by_id/<asteroid_id>", methods=["GET"])
@@ -139,19 +388,19 @@ def feed():
 #     tags=["asteroid"],
 # )
 def get_asteroid_data(asteroid_id):
-    nasa_key = os.getenv("NASA_API_KEY") or "DEMO_KEY"
-    if nasa_key == "DEMO_KEY":
-        current_app.logger.warning(
-            "NASA_API_KEY not set; using DEMO_KEY (rate-limited)."
-        )
+    # The derived orbital summary is cached rather than NASA's raw document
+    cache_key = f"neo:id:{asteroid_id}"
+    info = _cache_get(cache_key)
+    if info is not None:
+        return jsonify(info), 200
 
     nasa_url = f"https://api.nasa.gov/neo/rest/v1/neo/{asteroid_id}"
-    params = {"api_key": nasa_key}
+    params = {"api_key": current_app.config["NASA_API_KEY"]}
 
     try:
-        resp = requests.get(nasa_url, params=params, timeout=10)
+        resp = _SESSION.get(nasa_url, params=params, timeout=10)
         resp.raise_for_status()
-        data = resp.json()
+        data = orjson.loads(resp.content)
     except requests.exceptions.HTTPError as exc:
         current_app.logger.exception("NASA returned HTTP error")
         return (
@@ -177,9 +426,6 @@ def get_asteroid_data(asteroid_id):
     except ValueError as exc:
         return jsonify({"message": "Invalid JSON from NASA", "details": str(exc)}), 502
 
-    gravitational_constant = 6.67430 * (10 ** (-11))  # m^3 kg^-1 s^-2
-    sun_mass = 1.9885 * (10**30)  # kg
-
     diameter = (
         data["estimated_diameter"]["meters"]["estimated_diameter_max"]
         + data["estimated_diameter"]["meters"]["estimated_diameter_min"]
@@ -191,7 +437,7 @@ def get_asteroid_data(asteroid_id):
         * math.sqrt(1 - (eccentricity) ** 2)
     )
 
-    aphelion = float(data['orbital_data']['aphelion_distance']) * 149597870700
+    aphelion = float(data['orbital_data']['aphelion_distance']) * AU_M
 
     info = {
         "diameter": diameter,
@@ -209,232 +455,508 @@ def get_asteroid_data(asteroid_id):
         "eccentricity": data["orbital_data"]["eccentricity"],
         "aphelion": aphelion,
         "perihelion": data["orbital_data"]["perihelion_distance"],
-        "total_energy": (mass * gravitational_constant * sun_mass)
+        "total_energy": (mass * G * M_SUN)
         / (2 * (float(data["orbital_data"]["semi_major_axis"]))),
     }
 
+    _cache_set(cache_key, info, timeout=NEO_LOOKUP_TTL)
     return jsonify(info), 200
 
 
 
 
-WORLDPOP_BASE = os.getenv("WORLDPOP_BASE", "https://api.worldpop.org/v1/services/stats")
-WORLDPOP_DATASET = os.getenv("WORLDPOP_DATASET", "wpgppop")
-WORLDPOP_YEAR = os.getenv("WORLDPOP_YEAR", "2020")
 WORLDPOP_KEY = os.getenv("WORLDPOP_KEY")
+WORLDPOP_CACHE_DIR = os.getenv("WORLDPOP_CACHE_DIR", "/tmp/wp_cache")
+WORLDPOP_CACHE_TTL = 30 * 86400  # population rasters are yearly, a month is safe
+# Past WORLDPOP_CACHE_TTL an entry is only served when WorldPop itself fails
+WORLDPOP_CACHE_MAX_TTL = 365 * 86400
+# Definitive WorldPop failures (4xx, no data) and Nominatim misses are
+# remembered this long so repeats don't hammer the free APIs in a hot loop.
+# Transient ones (timeouts, 5xx) only briefly, so a blip heals quickly.
+UPSTREAM_FAILURE_TTL = 3600
+TRANSIENT_FAILURE_TTL = 30
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Physical constants (SI)
+G = 6.67430e-11  # m^3 kg^-1 s^-2
+M_SUN = 1.9885e30  # kg
+AU_M = 149597870700  # m
+JOULES_PER_TON = 4.184e9  # TNT equivalent
+JOULES_PER_MT = 4.184e15
+
+# Below this radius the impact circle spans only a handful of WorldPop ~100 m
+# cells, so a local raster (LOCAL_WP_TIF) is summed instead of calling the API
+LOCAL_RASTER_MAX_RADIUS_KM = 1.0
+
+# Lethality by impact energy (tons of TNT): energies at or above
+# _LETHAL_THR[i] (ascending) map to _LETHAL_VAL[i + 1]
+_LETHAL_THR = (1.0, 1e2, 1e4, 1e6)
+_LETHAL_VAL = (0.25, 0.5, 0.75, 0.9, 0.99)
+
+# User locations are snapped before building the impact circle so that
+# near-identical clicks share cache entries: 4 decimals is ~11 m, radius to 1 m
+LOCATION_DECIMALS = 4
+RADIUS_DECIMALS = 3
+
+# Bounds on the number of vertices of the circle polygon sent to WorldPop
+POLYGON_MIN_STEPS = 16
+POLYGON_MAX_STEPS = 64
+
+# Client-supplied polygons are rounded to ~1 m so equivalent ones share a key
+GEOJSON_DECIMALS = 5
+
+# Persistent (process-shared) cache for WorldPop population totals and
+# Nominatim place names, so repeated simulations skip the upstream calls.
+_WORLDPOP_CACHE = diskcache.Cache(WORLDPOP_CACHE_DIR, size_limit=1 << 30)
+
+# Background threads for independent upstream calls made within one request
+_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+# GDAL dataset handles are not safe for concurrent reads
+_RASTER_LOCK = threading.Lock()
+
+
+def _local_population(raster, lat, lon, radius_km):
+    """
+    Sum a north-up population raster over the cells whose centre falls
+    inside the impact circle.
 
-NOMINATIM_BASE = "https://nominatim.openstreetmap.org/reverse"
-
-@asteroid_blueprint.route("/simulate-impact", methods=["POST"])
-def simulate_impact():
+    Returns None when the circle is not wholly inside the raster, so the
+    caller asks WorldPop instead of trusting a partial sum.
     """
-    Simulate an impact on the world based on a given asteroid
+    transform = raster.transform
+    km_per_deg = math.pi * EARTH_RADIUS_KM / 180.0
+    cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+    dlat = radius_km / km_per_deg
+    dlon = dlat / cos_lat
+
+    # Pixel window covering the circle's bounding box
+    row_start = math.floor((lat + dlat - transform.f) / transform.e)
+    row_stop = math.floor((lat - dlat - transform.f) / transform.e) + 1
+    col_start = math.floor((lon - dlon - transform.c) / transform.a)
+    col_stop = math.floor((lon + dlon - transform.c) / transform.a) + 1
+    if (
+        row_start < 0
+        or col_start < 0
+        or row_stop > raster.height
+        or col_stop > raster.width
+    ):
+        return None
+
+    with _RASTER_LOCK:
+        data = raster.read(1, window=((row_start, row_stop), (col_start, col_stop)))
+
+    ys = transform.f + (np.arange(row_start, row_stop) + 0.5) * transform.e
+    xs = transform.c + (np.arange(col_start, col_stop) + 0.5) * transform.a
+    dy = (ys[:, None] - lat) * km_per_deg
+    dx = (xs[None, :] - lon) * km_per_deg * cos_lat
+    inside = dx * dx + dy * dy <= radius_km * radius_km
+
+    valid = data > 0
+    if raster.nodata is not None:
+        valid &= data != raster.nodata
+    return float(data[inside & valid].sum())
+
+
+@functools.lru_cache(maxsize=4096)
+def _circle_ring(lat, lon, radius_km):
     """
-    payload = request.get_json(force=True)
-    if not payload:
-        return jsonify({"error": "missing payload"}), 400
+    Return the closed ring of (lon, lat) vertices approximating a circle on
+    Earth, as a tuple of tuples.
 
-    geojson = payload.get("geojson")
+    Callers pass snapped coordinates (LOCATION_DECIMALS, RADIUS_DECIMALS), so
+    repeated and near-identical impacts are served from the cache.
+    """
+    # N points evaluated with the destination-point formula for every
+    # bearing at once.
+    # WorldPop's ~100m grid cannot tell a fine polygon from a coarse one,
+    # so N scales with the radius: a chord strays at most
+    # radius * (1 - cos(pi / N)) inside the arc (~1.9% at 16, ~0.1% at 64)
+    steps = max(
+        POLYGON_MIN_STEPS,
+        min(POLYGON_MAX_STEPS, int(8 * math.sqrt(max(radius_km, 0.0)))),
+    )
+    bearings = np.linspace(0.0, 2.0 * np.pi, steps + 1)
+    lat1 = math.radians(lat)
+    lon1 = math.radians(lon)
+    d = radius_km / EARTH_RADIUS_KM
+    sin_lat1, cos_lat1 = math.sin(lat1), math.cos(lat1)
+    sin_d, cos_d = math.sin(d), math.cos(d)
+    # sin(lat2) is needed again for the longitude, so keep it rather than
+    # taking np.sin of the arcsin
+    sin_lat2 = sin_lat1 * cos_d + cos_lat1 * sin_d * np.cos(bearings)
+    lat2 = np.arcsin(sin_lat2)
+    lon2 = lon1 + np.arctan2(
+        np.sin(bearings) * (sin_d * cos_lat1), cos_d - sin_lat1 * sin_lat2
+    )
+    # GeoJSON order: lon, lat
+    return tuple(map(tuple, np.degrees(np.column_stack([lon2, lat2])).tolist()))
+
+
+def _circle_geojson(lat, lon, radius_km):
+    """Build a GeoJSON FeatureCollection approximating a circle on Earth."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [_circle_ring(lat, lon, radius_km)],
+                },
+            }
+        ],
+    }
 
-    location = payload.get("location")
-    asteroid = payload.get("asteroid")
 
-    gravitational_constant = 6.67430 * (10 ** (-11))  # m^3 kg^-1 s^-2
-    sun_mass = 1.9885 * (10**30)  # kg
-    aphelion = float(asteroid['orbital_data']['aphelion_distance'])
+def _round_coords(coords):
+    """Round nested GeoJSON coordinate arrays to GEOJSON_DECIMALS."""
+    if isinstance(coords, list):
+        return [_round_coords(c) for c in coords]
+    if isinstance(coords, float):
+        return round(coords, GEOJSON_DECIMALS)
+    return coords
 
-    if not geojson and not location:
-        return jsonify({"error": "either geojson or location required"}), 400
 
-    if not geojson:
-        # Validate location
-        try:
-            lat = float(location.get("lat"))
-            lon = float(location.get("lon"))
-            radius_km = float(location.get("radius_km", 5.0))
-        except Exception:
-            return jsonify({"error": "invalid location payload"}), 400
-
-        # Build polygon (approximate great-circle circle) with N points
-        def destination_point(lat_deg, lon_deg, bearing_deg, distance_km):
-            R = 6371.0088  # Earth radius km
-            lat1 = math.radians(lat_deg)
-            lon1 = math.radians(lon_deg)
-            bearing = math.radians(bearing_deg)
-            d = distance_km / R
-            lat2 = math.asin(
-                math.sin(lat1) * math.cos(d)
-                + math.cos(lat1) * math.sin(d) * math.cos(bearing)
-            )
-            lon2 = lon1 + math.atan2(
-                math.sin(bearing) * math.sin(d) * math.cos(lat1),
-                math.cos(d) - math.sin(lat1) * math.sin(lat2),
-            )
-            return math.degrees(lat2), math.degrees(lon2)
-
-        steps = 64
-        coords = []
-        for i in range(steps + 1):
-            bearing = float(i) * (360.0 / steps)
-            lat2, lon2 = destination_point(lat, lon, bearing, radius_km)
-            coords.append([lon2, lat2])  # GeoJSON order: lon, lat
-        geojson = {
-            "type": "FeatureCollection",
-            "features": [
-                {
-                    "type": "Feature",
-                    "properties": {},
-                    "geometry": {"type": "Polygon", "coordinates": [coords]},
-                }
-            ],
+def _canonical_geojson(geojson):
+    """Return a copy of client GeoJSON with every coordinate rounded."""
+    if isinstance(geojson, list):
+        return [_canonical_geojson(v) for v in geojson]
+    if isinstance(geojson, dict):
+        return {
+            k: _round_coords(v) if k == "coordinates" else _canonical_geojson(v)
+            for k, v in geojson.items()
         }
+    return geojson
+
+
+def _place_key(lat, lon):
+    # ~100m buckets: zoom 10 resolves to city level anyway
+    return f"place:{round(lat, 3)}:{round(lon, 3)}"
 
-    # Call WorldPop stats service
+
+def _submit_reverse_geocode(lat, lon):
+    """
+    Start a reverse geocode on the shared executor and return its Future.
+
+    Cached places are resolved inline, without handing off to a thread.
+    """
+    place = _WORLDPOP_CACHE.get(_place_key(lat, lon))
+    if place is None:
+        # The worker thread has no app context, so it gets the URL up front
+        return _EXECUTOR.submit(
+            _reverse_geocode, current_app.config["NOMINATIM_BASE"], lat, lon
+        )
+    future = Future()
+    future.set_result(place or None)
+    return future
+
+
+def _reverse_geocode(nominatim_base, lat, lon):
+    """Best-effort Nominatim lookup of a display name, or None on failure."""
+    place_key = _place_key(lat, lon)
+    place = _WORLDPOP_CACHE.get(place_key)
+    if place is not None:
+        # "" remembers a recent miss
+        return place or None
+
+    try:
+        r = _SESSION.get(
+            nominatim_base,
+            params={
+                "lat": lat,
+                "lon": lon,
+                "format": "jsonv2",
+                "zoom": 10,
+            },
+            headers={"User-Agent": "asteroid-sim/1.0"},
+            timeout=10,
+        )
+        transient = r.status_code >= 500 or r.status_code == 429
+        if r.status_code == 200:
+            place = orjson.loads(r.content).get("display_name")
+    except Exception:
+        place = None
+        transient = True
+
+    if place is not None:
+        _WORLDPOP_CACHE.set(place_key, place, expire=WORLDPOP_CACHE_TTL)
+    else:
+        ttl = TRANSIENT_FAILURE_TTL if transient else UPSTREAM_FAILURE_TTL
+        _WORLDPOP_CACHE.set(place_key, "", expire=ttl)
+    return place
+
+
+def _request_worldpop_population(geojson_str):
+    """
+    Query the WorldPop stats service for the population inside a GeoJSON
+    polygon, polling the task if WorldPop answers asynchronously.
+
+    Raises UpstreamError with the error body and status to return.
+    """
+    config = current_app.config
     wp_params = {
-        "dataset": WORLDPOP_DATASET,
-        "year": WORLDPOP_YEAR,
-        "geojson": json.dumps(geojson),
+        "dataset": config["WORLDPOP_DATASET"],
+        "year": config["WORLDPOP_YEAR"],
+        "geojson": geojson_str,
         "runasync": "false",
     }
 
     try:
-        resp = requests.get(WORLDPOP_BASE, params=wp_params, timeout=60)
+        resp = _SESSION.get(
+            config["WORLDPOP_BASE"], params=wp_params, timeout=60, stream=True
+        )
     except requests.exceptions.RequestException as exc:
         current_app.logger.exception("WorldPop request failed")
-        return jsonify({"error": "WorldPop request failed", "details": str(exc)}), 502
+        raise UpstreamError(
+            {"error": "WorldPop request failed", "details": str(exc)},
+            502,
+            transient=True,
+        )
 
     if resp.status_code != 200:
-        return jsonify({"error": "WorldPop request failed", "details": resp.text}), 502
+        raise UpstreamError(
+            {"error": "WorldPop request failed", "details": resp.text},
+            502,
+            transient=resp.status_code >= 500 or resp.status_code == 429,
+        )
 
-    wp_json = resp.json()
+    try:
+        wp_json = orjson.loads(resp.content)
+    except orjson.JSONDecodeError as exc:
+        raise UpstreamError(
+            {"error": "Invalid JSON from WorldPop", "details": str(exc)},
+            502,
+            transient=True,
+        )
     population = None
 
     # handle both direct data and possible async task response
     if wp_json.get("status") == "created" and "taskid" in wp_json:
         taskid = wp_json["taskid"]
         task_url = f"https://api.worldpop.org/v1/tasks/{taskid}"
-        # poll briefly
-        for _ in range(30):
-            t = requests.get(task_url)
-            if t.status_code == 200:
-                tj = t.json()
-                if tj.get("status") == "finished":
-                    population = tj.get("data", {}).get("total_population", 0)
-                    break
-            time.sleep(0.5)
-        else:
-            return jsonify({"error": "WorldPop task did not finish in time"}), 504
+        # poll with exponential backoff (0.2s, 0.4s, 0.8s, ... capped at 2s) so
+        # quick tasks return after a short sleep, giving up after ~15s overall.
+        # A poll that errors or times out is just retried on the next round.
+        delay = 0.2
+        deadline = time.monotonic() + 15.0
+        while True:
+            tj = None
+            try:
+                t = _SESSION.get(task_url, timeout=5)
+                if t.status_code == 200:
+                    tj = orjson.loads(t.content)
+            except (requests.exceptions.RequestException, orjson.JSONDecodeError):
+                pass
+            if tj is not None and tj.get("status") == "finished":
+                population = (tj.get("data") or {}).get("total_population", 0)
+                break
+            if time.monotonic() + delay > deadline:
+                raise UpstreamError(
+                    {"error": "WorldPop task did not finish in time"},
+                    504,
+                    transient=True,
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
     else:
-        population = (
-            wp_json.get("data", {}).get("total_population")
-            if wp_json.get("data")
-            else None
-        )
+        data = wp_json.get("data")
+        population = data.get("total_population") if data else None
 
     if population is None:
-        return (
-            jsonify(
-                {
-                    "error": "Could not extract population from WorldPop response",
-                    "raw": wp_json,
-                }
-            ),
+        raise UpstreamError(
+            {
+                "error": "Could not extract population from WorldPop response",
+                "raw": wp_json,
+            },
             500,
         )
 
-    # Reverse geocode center for display (best-effort)
-    place = None
+    return population
+
+
+def _json_body_any_content_type(view):
+    """
+    Parses the request body as JSON whatever its Content-Type.
+
+    Some clients post JSON as text/plain (e.g. fetch without headers, to skip
+    the CORS preflight). spectree only reads JSON bodies, but it goes through
+    request.get_json, which returns the value parsed and cached here.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        request.get_json(force=True, silent=True)
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+@asteroid_blueprint.route("/simulate-impact", methods=["POST"])
+@limiter.limit("20/minute")
+@_json_body_any_content_type
+@api.validate(
+    json=SimulateImpactRequest,
+    resp=Response(HTTP_200=None, HTTP_500=None, HTTP_502=None, HTTP_504=None),
+    tags=["asteroid"],
+)
+def simulate_impact():
+    """
+    Simulate an impact on the world based on a given asteroid
+    """
+    payload = request.context.json
+
+    geojson = payload.geojson
+    location = payload.location
+    asteroid = payload.asteroid
+
+    aphelion = asteroid.orbital_data.aphelion_distance
+
+    snapped_location = None
+    center = None
+    if not geojson:
+        lat = round(location.lat, LOCATION_DECIMALS)
+        lon = round(location.lon, LOCATION_DECIMALS)
+        radius_km = round(location.radius_km, RADIUS_DECIMALS)
+        snapped_location = {"lat": lat, "lon": lon, "radius_km": radius_km}
+        center = (lat, lon)
+
+    # Reverse geocode center for display (best-effort). Nominatim only needs
+    # the centroid, so it runs concurrently with the WorldPop lookup below.
+    place_future = None
     try:
-        # compute centroid from polygon's first feature
-        features = geojson.get("features") if isinstance(geojson, dict) else None
-        if features and len(features) > 0:
-            geom = features[0].get("geometry")
-            if geom and geom.get("type") == "Polygon":
-                ring = geom["coordinates"][0]
-                xs = [p[0] for p in ring]
-                ys = [p[1] for p in ring]
-                lon_cent = sum(xs) / len(xs)
-                lat_cent = sum(ys) / len(ys)
-                r = requests.get(
-                    NOMINATIM_BASE,
-                    params={
-                        "lat": lat_cent,
-                        "lon": lon_cent,
-                        "format": "jsonv2",
-                        "zoom": 10,
-                    },
-                    headers={"User-Agent": "asteroid-sim/1.0"},
-                    timeout=10,
-                )
-                if r.status_code == 200:
-                    place = r.json().get("display_name")
+        if center is None:
+            # compute centroid from polygon's first feature
+            features = geojson.get("features") if isinstance(geojson, dict) else None
+            if features and len(features) > 0:
+                geom = features[0].get("geometry")
+                if geom and geom.get("type") == "Polygon":
+                    ring = geom["coordinates"][0]
+                    # GeoJSON rings repeat the first vertex at the end; count
+                    # it once so it doesn't pull the centroid towards itself
+                    n = len(ring)
+                    if n > 1 and ring[0] == ring[-1]:
+                        n -= 1
+                    sx = sy = 0.0
+                    for i in range(n):
+                        sx += ring[i][0]
+                        sy += ring[i][1]
+                    center = (sy / n, sx / n)
+        if center is not None:
+            place_future = _submit_reverse_geocode(*center)
     except Exception:
-        place = None
+        place_future = None
+
+    # Population for an identical area/dataset/year never changes. Circles are
+    # keyed by their snapped parameters, so the polygon is only built on a
+    # miss; client polygons are serialized once, compact and with canonical
+    # key order, and the same string is sent to WorldPop and hashed.
+    wp_dataset = current_app.config["WORLDPOP_DATASET"]
+    wp_year = current_app.config["WORLDPOP_YEAR"]
+    if snapped_location is not None:
+        geojson_str = None
+        wp_key = (
+            f"population:circle:{lat}:{lon}:{radius_km}"
+            f":{wp_dataset}:{wp_year}"
+        )
+    else:
+        geojson_str = orjson.dumps(
+            _canonical_geojson(geojson), option=orjson.OPT_SORT_KEYS
+        ).decode()
+        wp_key = "population:" + hashlib.blake2b(
+            (geojson_str + wp_dataset + wp_year).encode(),
+            digest_size=16,
+        ).hexdigest()
+    population = None
 
-    # Compute lethality using asteroid info when available
-    try:
-        # default lethality (if no asteroid info): simple function of radius
-        if asteroid and isinstance(asteroid, dict):
-            # try to use impact energy if present
-            impact_energy_tnt = asteroid.get("impact_energy_tnt")
-            mass_kg = asteroid.get("mass_kg")
-            v_km_s = asteroid.get("entry_speed_km_s") or asteroid.get(
-                "relative_velocity_km_s"
+    # Small circles are summed from the local raster when one is configured
+    # and covers them
+    wp_raster = current_app.extensions.get("wp_raster")
+    if (
+        wp_raster is not None
+        and snapped_location is not None
+        and radius_km < LOCAL_RASTER_MAX_RADIUS_KM
+    ):
+        population = _local_population(wp_raster, lat, lon, radius_km)
+
+    population_is_stale = False
+    entry = None
+    if population is None:
+        entry = _WORLDPOP_CACHE.get(wp_key)
+        if entry is not None and time.time() - entry[0] < WORLDPOP_CACHE_TTL:
+            population = entry[1]
+
+    if population is None:
+        failure = _WORLDPOP_CACHE.get(wp_key + ":failure")
+        try:
+            if failure is not None:
+                raise UpstreamError(*failure)
+            if geojson_str is None:
+                geojson_str = orjson.dumps(
+                    _circle_geojson(lat, lon, radius_km), option=orjson.OPT_SORT_KEYS
+                ).decode()
+            population = _request_worldpop_population(geojson_str)
+        except UpstreamError as exc:
+            if failure is None:
+                ttl = TRANSIENT_FAILURE_TTL if exc.transient else UPSTREAM_FAILURE_TTL
+                _WORLDPOP_CACHE.set(
+                    wp_key + ":failure", (exc.payload, exc.status), expire=ttl
+                )
+            # Serve an older answer rather than failing while WorldPop is down
+            if entry is None:
+                if place_future is not None:
+                    place_future.cancel()
+                return jsonify(exc.payload), exc.status
+            current_app.logger.warning(
+                "WorldPop unavailable; serving stale population"
             )
-            # if impact_energy not available, compute from mass & speed if possible
-            if impact_energy_tnt is None and mass_kg and v_km_s:
-                v_m_s = float(v_km_s) * 1000.0
-                energy_j = 0.5 * float(mass_kg) * v_m_s * v_m_s
-                impact_energy_tnt = energy_j / 4.184e9
-            # determine lethality from energy thresholds
-            lethality = 0.5  # baseline
-            if impact_energy_tnt is not None:
-                e = float(impact_energy_tnt)
-                if e >= 1e6:
-                    lethality = 0.99
-                elif e >= 1e4:
-                    lethality = 0.9
-                elif e >= 1e2:
-                    lethality = 0.75
-                elif e >= 1:
-                    lethality = 0.5
-                else:
-                    lethality = 0.25
-            else:
-                # fallback to radius heuristic
-                try:
-                    radius_km_val = (
-                        float(location.get("radius_km", 5.0)) if location else 5.0
-                    )
-                except Exception:
-                    radius_km_val = 5.0
-                lethality = 0.9 if radius_km_val >= 5 else 0.5
+            population, population_is_stale = entry[1], True
         else:
-            # no asteroid info: simple radius-based lethality
-            radius_km_val = float(location.get("radius_km", 5.0)) if location else 5.0
-            lethality = 0.9 if radius_km_val >= 5 else 0.5
+            _WORLDPOP_CACHE.set(
+                wp_key, (time.time(), population), expire=WORLDPOP_CACHE_MAX_TTL
+            )
 
-        estimated_kills = int(round(population * lethality))
-    except Exception:
-        estimated_kills = None
+    place = None
+    if place_future is not None:
+        try:
+            place = place_future.result(timeout=10)
+        except Exception:
+            place = None
+
+    # Compute lethality using asteroid info when available: from the impact
+    # energy if it is given or can be derived from mass & speed
+    impact_energy_tnt = asteroid.impact_energy_tnt
+    v_km_s = asteroid.entry_speed_km_s or asteroid.relative_velocity_km_s
+    if impact_energy_tnt is None and asteroid.mass_kg and v_km_s:
+        v_m_s = v_km_s * 1000.0
+        energy_j = 0.5 * asteroid.mass_kg * v_m_s * v_m_s
+        impact_energy_tnt = energy_j / JOULES_PER_TON
+
+    if impact_energy_tnt is not None:
+        # determine lethality from energy thresholds
+        lethality = _LETHAL_VAL[bisect_right(_LETHAL_THR, impact_energy_tnt)]
+    else:
+        # fallback to radius heuristic
+        radius_km_val = location.radius_km if location is not None else 5.0
+        lethality = 0.9 if radius_km_val >= 5 else 0.5
+
+    estimated_kills = (
+        int(round(population * lethality)) if population is not None else None
+    )
 
     density = 2500
 
-    diameter = None
-    if asteroid and isinstance(asteroid, dict):
-        diameter = float(asteroid["diameterMeters"])
-        
-    impact_velocity = math.sqrt((gravitational_constant * 2 * sun_mass)/aphelion) # NOTE THAT THIS VELOCITY IS THE MAXIMUM IMPACT VELOCITY, LATER WE WILL ASSUME THIS IS THE CASE, THE PROGRAM WILL RETURN THIS VELOCITY IN M/S!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!, AND IF WE MAKE CALCULATIONS WITH IT, WE WILL DIVIDE IT BY 1000, SO IT WILL APPEAR IN KM/S
-    
-    velocity_km_s = None
-    if asteroid and isinstance(asteroid, dict):
-        velocity_km_s = asteroid.get("relative_velocity_km_s")
+    diameter = asteroid.diameterMeters
 
-        if velocity_km_s is None:
-            cad = asteroid.get("close_approach_data") or asteroid.get("closeApproachData")
-            if isinstance(cad, list) and len(cad) > 0 and isinstance(cad[0], dict):
-                rv = cad[0].get("relative_velocity") or cad[0].get("relativeVelocity") or {}
-                velocity_km_s = rv.get("kilometers_per_second") or rv.get("kilometersPerSecond")
+    impact_velocity = math.sqrt((G * 2 * M_SUN)/aphelion) # NOTE THAT THIS VELOCITY IS THE MAXIMUM IMPACT VELOCITY, LATER WE WILL ASSUME THIS IS THE CASE, THE PROGRAM WILL RETURN THIS VELOCITY IN M/S!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!, AND IF WE MAKE CALCULATIONS WITH IT, WE WILL DIVIDE IT BY 1000, SO IT WILL APPEAR IN KM/S
+    
+    velocity_km_s = asteroid.relative_velocity_km_s
+    cad = asteroid.close_approach_data
+    if velocity_km_s is None and cad:
+        rv = cad[0].get("relative_velocity") or cad[0].get("relativeVelocity") or {}
+        velocity_km_s = rv.get("kilometers_per_second") or rv.get("kilometersPerSecond")
 
     try:
         velocity_km_s = float(velocity_km_s) if velocity_km_s is not None else None
@@ -454,25 +976,28 @@ def simulate_impact():
 
     k_energy = 0.5 * mass * velocity_m_s**2
 
-    k_energy_mt = k_energy / (4.184*(10**15)) 
+    k_energy_mt = k_energy / JOULES_PER_MT
+    k_energy_mt_cbrt = math.cbrt(k_energy_mt)
     crater_diameter = 0.765 * k_energy_mt**(1/3.4) * 10
 
     crater_depth = 0.4*(crater_diameter**0.3)
 
-    fireball_radius = 60 * (k_energy_mt**(1/3))
+    fireball_radius = 60 * k_energy_mt_cbrt
 
-    shock_wave = 3 * (k_energy_mt**(1/3))
+    shock_wave = 3 * k_energy_mt_cbrt
 
-    pressure_at_20radius = 15 * (k_energy_mt**(1/3))/(20*(diameter/2))
+    pressure_at_20radius = 15 * k_energy_mt_cbrt/(20*(diameter/2))
 
     wind_velocity_at_20radius = 1055 * (pressure_at_20radius)/(math.sqrt(103+7*pressure_at_20radius))
 
     sismic_energy = 0.0001 * k_energy
     sismic_magnitude = (3/2) * (math.log10(sismic_energy) - 4.8)
 
-    return jsonify(
+    response = jsonify(
         {
             "place": place,
+            # the location actually simulated, after snapping to the grid
+            "snapped_location": snapped_location,
             "population": int(population),
             "estimated_kills": estimated_kills,
             "lethality_used": float(lethality),
@@ -485,3 +1010,6 @@ def simulate_impact():
             "sismic_magnitude": float(round(sismic_magnitude, 3)),
         }
     )
+    if population_is_stale:
+        response.headers["Warning"] = STALE_WARNING
+    return response
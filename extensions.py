@@ -8,6 +8,8 @@ from flask_jwt_extended import JWTManager
 from flask_caching import Cache
 from flask_migrate import Migrate
 from flask_cors import CORS
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
 from spectree import SpecTree, SecurityScheme
 
 db = SQLAlchemy()
@@ -15,6 +17,7 @@ jwt = JWTManager()
 cache = Cache()
 migrate = Migrate()
 cors = CORS(supports_credentials=True)
+limiter = Limiter(get_remote_address)
 api = SpecTree(
     "flask",
     mode="strict",
@@ -1,10 +1,18 @@
 import importlib
 import os
+import pkgutil
+import time
+
+import click
 
 from config import config
 from flask import Blueprint, Flask
+from itsdangerous import URLSafeSerializer
 from utils.email_manager import EmailManager
-from extensions import db, jwt, cache, migrate, api, cors
+from utils.json_provider import OrJSONProvider
+from extensions import db, jwt, cache, migrate, api, cors, limiter
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import generate_password_hash
 
 from pathlib import Path
 
@@ -19,10 +27,22 @@ if "HTTPS" in os.environ:
 BASE_SERVER_URL = os.environ.get("BASE_SERVER_URL", "http://localhost:3000")
 
 
+def password_hash_method(method: str) -> str:
+    """
+    The spelling werkzeug stores in hashes for ``method``, with every default
+    filled in (e.g. "scrypt" -> "scrypt:32768:8:1"). Raises ValueError for an
+    unknown method.
+    """
+    return generate_password_hash("", method=method).split("$", 1)[0]
+
+
 def register_blueprints(app: Flask, package_path: str, url_prefix: str = None):
     """
     Dynamically discovers and registers Blueprints from a given package path.
 
+    Each module in the package exposes its Blueprint as a module-level
+    ``blueprint`` attribute; modules starting with an underscore are skipped.
+
     :param app: The Flask application instance.
     :param package_path: The filesystem path to the package (e.g., "controllers").
     :param url_prefix: An optional prefix for all blueprints found.
@@ -34,26 +54,19 @@ def register_blueprints(app: Flask, package_path: str, url_prefix: str = None):
 
     import_path = ".".join(package_dir.parts)
 
-    for file in package_dir.iterdir():
-        if (
-            not file.is_file()
-            or not file.name.endswith(".py")
-            or file.name.startswith("_")
-        ):
+    for module_info in pkgutil.iter_modules([str(package_dir)]):
+        if module_info.ispkg or module_info.name.startswith("_"):
             continue
 
-        module_name = file.stem
-
         try:
-            module = importlib.import_module(f".{module_name}", package=import_path)
+            module = importlib.import_module(f"{import_path}.{module_info.name}")
         except ImportError as e:
-            print(f"Warning: Could not import blueprint from {file.name}: {e}")
+            print(f"Warning: Could not import blueprint from {module_info.name}: {e}")
             continue
 
-        for obj in module.__dict__.values():
-            if isinstance(obj, Blueprint):
-                app.register_blueprint(obj, url_prefix=url_prefix)
-                break
+        blueprint = getattr(module, "blueprint", None)
+        if isinstance(blueprint, Blueprint):
+            app.register_blueprint(blueprint, url_prefix=url_prefix)
 
 
 def register_loaders(app: Flask):
@@ -64,16 +77,52 @@ def register_loaders(app: Flask):
     from models.user import User
 
     @cache.memoize(timeout=20)
+    def load_user(identity):
+        """Cache-aware user lookup, keyed by the identity string only."""
+        return User.query.filter(
+            db.func.lower(User.email) == identity.lower()
+        ).first()
+
     @jwt.user_lookup_loader
     def user_lookup_loader(_jwt_header, jwt_data):
         """
         This function is called whenever a protected endpoint is accessed,
         and must return an object that represents the user identity.
         """
-        identity = jwt_data["sub"]
+        user = load_user(jwt_data["sub"])
+        if user is None:
+            return None
+
+        # Cached users come back detached; attach them without a query
+        return db.session.merge(user, load=False)
+
+
+def register_commands(app: Flask):
+    """Register the project's `flask` CLI commands."""
+
+    @app.cli.command("calibrate-password-hash")
+    @click.option("--target-ms", default=100, show_default=True)
+    @click.option(
+        "--algorithm", type=click.Choice(["scrypt", "pbkdf2"]), default="scrypt"
+    )
+    def calibrate_password_hash(target_ms, algorithm):
+        """Find the cheapest hash cost that takes at least --target-ms here."""
+        if algorithm == "scrypt":
+            cost, make_method = 2**14, "scrypt:{}:8:1".format
+        else:
+            cost, make_method = 100_000, "pbkdf2:sha256:{}".format
+
+        while True:
+            method = make_method(cost)
+            started = time.perf_counter()
+            generate_password_hash("calibration-password", method=method)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if elapsed_ms >= target_ms:
+                break
+            cost *= 2
 
-        # Using a more performant cache-aware lookup
-        return User.query.filter_by(email=identity).first()
+        click.echo(f"{elapsed_ms:.0f} ms with {method}")
+        click.echo(f"PASSWORD_HASH_METHOD={method}")
 
 
 def create_app(config_name: str = None) -> Flask:
@@ -89,21 +138,48 @@ def create_app(config_name: str = None) -> Flask:
 
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    # Stored hashes are compared against this on login, so spell it the way
+    # werkzeug writes it; otherwise every login would re-hash
+    app.config["PASSWORD_HASH_METHOD"] = password_hash_method(
+        app.config["PASSWORD_HASH_METHOD"]
+    )
+    app.json = OrJSONProvider(app)
 
     # Initialize Flask extensions
     db.init_app(app)
     jwt.init_app(app)
     cache.init_app(app)
     cors.init_app(app)
+    limiter.init_app(app)
+
+    # Behind a reverse proxy the client address is in X-Forwarded-For; trust
+    # it only for the configured number of hops so rate limits stay per-client
+    if app.config.get("TRUSTED_PROXIES"):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config["TRUSTED_PROXIES"])
 
     # Note: migrate.init_app requires both app and db
     migrate.init_app(app, db)
 
+    if app.config["NASA_API_KEY"] == "DEMO_KEY":
+        app.logger.warning("NASA_API_KEY not set; using DEMO_KEY (rate-limited).")
+
     # Attach a custom manager to the app context, avoiding globals
     app.email_manager = EmailManager(app)
 
+    # The confirmation token serializer derives its signing key once, here
+    app.extensions["confirm_serializer"] = URLSafeSerializer(
+        app.config["SECRET_KEY"], salt="email-confirm"
+    )
+
+    # Optional local population raster; rasterio is only needed when it is set
+    if app.config.get("LOCAL_WP_TIF"):
+        import rasterio
+
+        app.extensions["wp_raster"] = rasterio.open(app.config["LOCAL_WP_TIF"])
+
     # Register components
     register_loaders(app)
+    register_commands(app)
     register_blueprints(app, "controllers")
 
     api.config.title = f"{app.config.get('PRODUCT_NAME')} API"
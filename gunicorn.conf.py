@@ -0,0 +1,10 @@
+# Gunicorn settings, picked up automatically by `gunicorn main:app`.
+import os
+
+# Every endpoint spends nearly all of its time waiting on NASA, WorldPop or
+# Nominatim, so each worker serves requests on a pool of threads instead of
+# one at a time. Threads in a worker share the HTTP session, the executor and
+# the in-process caches.
+worker_class = "gthread"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 16))
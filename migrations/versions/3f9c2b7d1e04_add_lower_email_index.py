@@ -0,0 +1,27 @@
+"""add lower(email) index on user
+
+Revision ID: 3f9c2b7d1e04
+Revises: 64cad454a252
+Create Date: 2026-10-15 09:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2b7d1e04'
+down_revision = '64cad454a252'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Fails if two existing emails differ only by case; merge those first
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_email_lower', [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_email_lower')
@@ -110,4 +110,4 @@ class OrmBase(BaseModel):
     model_config = {"from_attributes": True}
 
 
-from .user import UserDTO
+from .user import UserDTO, UserDetailDTO, user_image_url
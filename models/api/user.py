@@ -1,10 +1,25 @@
 from . import OrmBase
 
+from config import Config
 from factory import URL_SCHEMA
 
-from flask import url_for
+from datetime import datetime
+from typing import Optional
+
 from pydantic import Field, computed_field
 
+# Profile images are served from /image/user_profile/<user_id>. The prefix is
+# resolved once at import, so building a URL is a plain concatenation with no
+# URL-map lookup and no app or request context needed.
+IMAGE_URL_PREFIX = f"{URL_SCHEMA}://{Config.SERVER_NAME}/image/user_profile/"
+
+
+def user_image_url(user_id, variant=None):
+    """External URL of a user's profile image, optionally of one variant."""
+    if variant is None:
+        return f"{IMAGE_URL_PREFIX}{user_id}"
+    return f"{IMAGE_URL_PREFIX}{user_id}?variant={variant}"
+
 
 class UserDTO(OrmBase):
     fullname: str = Field(..., example="John Doe")
@@ -13,9 +28,15 @@ class UserDTO(OrmBase):
     @computed_field
     @property
     def image(self) -> str:
-        return url_for(
-            "image_controller.user_profile",
-            user_id=self.id,
-            _external=True,
-            _scheme=URL_SCHEMA,
-        )
+        return user_image_url(self.id)
+
+
+class UserDetailDTO(UserDTO):
+    """Full profile, including the deferred personal and location columns."""
+
+    gender: Optional[str] = None
+    birthday_date: Optional[datetime] = None
+    last_city: Optional[str] = None
+    last_region: Optional[str] = None
+    last_country: Optional[str] = None
+    last_location_update: Optional[datetime] = None
@@ -1,36 +1,54 @@
-import base64
-from datetime import datetime, timedelta, timezone
+from datetime import timedelta, timezone
 
-from flask import current_app, render_template, url_for
-from itsdangerous import Serializer
+from flask import current_app
+from itsdangerous import BadSignature
+from sqlalchemy import inspect as sa_inspect, update
 from sqlalchemy.orm import deferred
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
-from factory import URL_SCHEMA, db
-from utils.email_manager import EmailManager
+from factory import db
 
-from models.api import UserDTO
+from models.api import UserDTO, UserDetailDTO, user_image_url
+from utils.clock import utcnow
+
+# Seconds between last_seen writes for the same user
+PING_INTERVAL = 60
+
+# Deferred columns read by UserDetailDTO
+_DETAIL_COLUMNS = (
+    "gender",
+    "birthday_date",
+    "last_city",
+    "last_region",
+    "last_country",
+)
+
+# Dialects whose insert() supports on_conflict_do_update
+_UPSERT_INSERTS = {"postgresql": pg_insert, "sqlite": sqlite_insert}
 
 
 class User(db.Model):
     __tablename__ = "user"
+    # Emails are looked up case-insensitively via lower(email)
+    __table_args__ = (
+        db.Index("ix_user_email_lower", db.func.lower(db.text("email")), unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True, index=True)
     first_name = db.Column(db.Unicode(64))
     last_name = db.Column(db.Unicode(64), default="")
-    fullname = db.column_property(first_name + " " + last_name)
 
     username = db.Column(db.String(64), index=True)
     email = db.Column(db.String(64), index=True, unique=True)
     password_hash = db.Column(db.String(256))
-    created_at = db.Column(
-        db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc)
-    )
+    created_at = db.Column(db.DateTime(timezone=True), default=utcnow)
     last_seen = db.Column(
         db.DateTime(timezone=True),
-        default=lambda: datetime.now(timezone.utc),
+        default=utcnow,
         index=True,
     )
     role_id = db.Column(db.Integer, db.ForeignKey("roles.id"), index=True)
@@ -46,8 +64,11 @@ class User(db.Model):
     gender = deferred(db.Column(db.String(32)), group="personal")
     birthday_date = deferred(db.Column(db.DateTime(timezone=True)), group="personal")
 
-    original_profile_image_bytes = deferred(db.Column(db.LargeBinary), group="images")
-    profile_image_bytes = deferred(db.Column(db.LargeBinary), group="images")
+    # Separate groups so loading the thumbnail doesn't also pull the original
+    original_profile_image_bytes = deferred(
+        db.Column(db.LargeBinary), group="image_original"
+    )
+    profile_image_bytes = deferred(db.Column(db.LargeBinary), group="image_thumb")
 
     # Location
     last_lat = deferred(db.Column(db.Float), group="location")
@@ -55,24 +76,30 @@ class User(db.Model):
     last_city = deferred(db.Column(db.Unicode(32)), group="location")
     last_region = deferred(db.Column(db.Unicode(32)), group="location")
     last_country = deferred(db.Column(db.Unicode(32)), group="location")
-    last_location_update = deferred(
-        db.Column(db.DateTime(timezone=True)), group="location"
-    )
+    # Loaded eagerly so is_location_updated doesn't pull the whole group
+    last_location_update = db.Column(db.DateTime(timezone=True))
+
+    @property
+    def fullname(self):
+        return f"{self.first_name} {self.last_name or ''}".rstrip()
 
     def to_dict(self):
         return UserDTO.model_validate(self).model_dump()
 
+    def to_detail_dict(self):
+        # Load the deferred personal and location columns in one SELECT
+        # instead of one per group as validation touches them
+        unloaded = sa_inspect(self).unloaded.intersection(_DETAIL_COLUMNS)
+        if unloaded and self.id is not None:
+            db.session.refresh(self, attribute_names=sorted(unloaded))
+        return UserDetailDTO.model_validate(self).model_dump()
+
     def to_simple_dict(self):
         return {
             "id": self.id,
             "name": self.fullname,
             "color": self.color,
-            "image": url_for(
-                "images_blueprint.user_profile",
-                user_id=self.id,
-                _external=True,
-                _scheme=URL_SCHEMA,
-            ),
+            "image": user_image_url(self.id),
         }
 
     @property
@@ -80,7 +107,7 @@ class User(db.Model):
         if self.birthday_date is None:
             return None
 
-        today = datetime.now(timezone.utc)
+        today = utcnow()
         birthday = self.birthday_date
         age = today.year - birthday.year
         if today.month < birthday.month or (
@@ -92,59 +119,61 @@ class User(db.Model):
 
     @property
     def is_location_updated(self):
-        if self.last_location_update is None:
+        last_update = self.last_location_update
+        if last_update is None:
             return False
 
-        now = datetime.now(timezone.utc)
+        now = utcnow()
+        # SQLite hands back naive datetimes even for timezone=True columns
+        if last_update.tzinfo is None:
+            last_update = last_update.replace(tzinfo=timezone.utc)
 
-        if now - self.last_location_update > timedelta(days=1):
+        if now - last_update > timedelta(days=1):
             return False
 
         return True
 
+    # The images are served by URL rather than inlined as base64, so reading
+    # these never loads the deferred image groups
     @property
     def original_profile_image(self):
-        return "data:;base64," + base64.b64encode(
-            self.original_profile_image_bytes
-        ).decode("utf-8")
+        return user_image_url(self.id, variant="original")
 
     @property
     def profile_image(self):
-        if self.profile_image_bytes is not None:
-            return "data:;base64," + base64.b64encode(self.profile_image_bytes).decode(
-                "utf-8"
-            )
-
-        return url_for("static", filename="photos/default.png")
+        return user_image_url(self.id)
 
     def generate_confirmation_token(self):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
+        serializer = current_app.extensions["confirm_serializer"]
         return serializer.dumps({"confirm": self.id})
 
     def confirm_email(self, token):
-        serializer = Serializer(current_app.config["SECRET_KEY"])
+        serializer = current_app.extensions["confirm_serializer"]
 
         try:
             data = serializer.loads(token)
-        except:
+        except BadSignature:
             return False
 
         if data.get("confirm") != self.id:
             return False
 
-        self.is_email_valid = True
-        db.session.add(self)
+        db.session.execute(
+            update(User).where(User.id == self.id).values(is_email_valid=True)
+        )
         return True
 
     def send_confirmation_code(self):
         try:
-            email_manager = EmailManager(current_app)
+            email_manager = current_app.email_manager
             token = self.generate_confirmation_token()
             email_manager.send_email(
                 self.email,
                 "Confirme seu email",
-                render_template("emails/confirm_email.txt", user=self, token=token),
-                render_template(
+                email_manager.render(
+                    "emails/confirm_email.txt", user=self, token=token
+                ),
+                email_manager.render(
                     "emails/HTML/confirm_email.html", user=self, token=token
                 ),
                 asynchronous=True,
@@ -159,18 +188,43 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(
+            password, method=current_app.config["PASSWORD_HASH_METHOD"]
+        )
 
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if not check_password_hash(self.password_hash, password):
+            return False
+
+        # Upgrade hashes made with an older method now that we have the
+        # password. The configured method is already in werkzeug's stored
+        # spelling (see create_app), so an up-to-date hash compares equal.
+        stored_method = self.password_hash.split("$", 1)[0]
+        if (
+            current_app.config.get("PASSWORD_HASH_REHASH")
+            and stored_method != current_app.config["PASSWORD_HASH_METHOD"]
+        ):
+            self.password = password
+            db.session.add(self)
+            db.session.commit()
+
+        return True
 
     @property
     def is_authenticated(self):
         return True
 
     def ping(self):
-        self.last_seen = datetime.now(timezone.utc)
-        db.session.add(self)
+        now = utcnow()
+        last_seen = self.last_seen
+        if last_seen is not None:
+            # SQLite hands back naive datetimes even for timezone=True columns
+            if last_seen.tzinfo is None:
+                last_seen = last_seen.replace(tzinfo=timezone.utc)
+            if now - last_seen < timedelta(seconds=PING_INTERVAL):
+                return
+
+        db.session.execute(update(User).where(User.id == self.id).values(last_seen=now))
         db.session.commit()
 
     @property
@@ -187,21 +241,32 @@ class User(db.Model):
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
 
-        # role is a backref from Role table
+        # role is a backref from Role table; assign the FK so nothing autoflushes
         # pylint: disable=access-member-before-definition
-        if self.role is None:
-            admin_email = current_app.config.get("ADMIN_EMAIL")
-            if admin_email and self.email in admin_email:
-                self.role = Role.query.filter_by(permissions=0xFF).first()
-        if self.role is None:
-            self.role = Role.query.filter_by(default=1).first()
+        if self.role is None and self.role_id is None:
+            role_ids = Role.cached_ids()
+            admins = current_app.config.get("ADMINS", ())
+            if self.email and self.email.lower() in admins:
+                self.role_id = role_ids["admin"]
+            if self.role_id is None:
+                self.role_id = role_ids["default"]
+
+    @property
+    def _permission_bits(self):
+        """The role's permission mask, loaded once per instance (0 if no role)."""
+        bits = self.__dict__.get("_permission_cache")
+        if bits is None:
+            role = self.role
+            # New users only have role_id set until they are flushed
+            if role is None and self.role_id is not None:
+                role = db.session.get(Role, self.role_id)
+            bits = role.permissions if role is not None else 0
+            self.__dict__["_permission_cache"] = bits
+        return bits
 
     # Check if the user can perform a specif action
     def can(self, permissions):
-        return (
-            self.role is not None
-            and (self.role.permissions & permissions) == permissions
-        )
+        return (self._permission_bits & permissions) == permissions
 
 
 class Permission:
@@ -239,11 +304,46 @@ class Role(db.Model):
             "Administrator": (0xFF, 0),
         }
 
-        for role_name in roles:
-            role = Role.query.filter_by(name=role_name).first()
-            if role is None:
-                role = Role(name=role_name)
-            role.permissions = roles[role_name][0]
-            role.default = roles[role_name][1]
-            db.session.add(role)
+        dialect = db.session.get_bind().dialect.name
+        if dialect in _UPSERT_INSERTS:
+            # One INSERT ... ON CONFLICT for all roles
+            stmt = _UPSERT_INSERTS[dialect](Role.__table__).values(
+                [
+                    {"name": name, "permissions": permissions, "default": default}
+                    for name, (permissions, default) in roles.items()
+                ]
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["name"],
+                set_={
+                    "permissions": stmt.excluded.permissions,
+                    "default": stmt.excluded.default,
+                },
+            )
+            db.session.execute(stmt)
+        else:
+            for role_name in roles:
+                role = Role.query.filter_by(name=role_name).first()
+                if role is None:
+                    role = Role(name=role_name)
+                role.permissions = roles[role_name][0]
+                role.default = roles[role_name][1]
+                db.session.add(role)
         db.session.commit()
+        current_app.extensions.pop("role_cache", None)
+
+    @staticmethod
+    def cached_ids():
+        """Returns the admin and default role ids, loading them once per app."""
+        role_ids = current_app.extensions.get("role_cache")
+        if role_ids is None:
+            admin = Role.query.filter_by(permissions=0xFF).first()
+            default = Role.query.filter_by(default=1).first()
+            role_ids = {
+                "admin": admin.id if admin else None,
+                "default": default.id if default else None,
+            }
+            # Don't remember a missing role; insert_roles may not have run yet
+            if None not in role_ids.values():
+                current_app.extensions["role_cache"] = role_ids
+        return role_ids
@@ -1,4 +1,6 @@
 import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import scoped_session, sessionmaker
 from factory import create_app, db
 from models.user import User  # Import a model to help with seeding
 
@@ -17,10 +19,10 @@ def seed_database():
     db.session.commit()
 
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def app():
     """
-    A fixture that creates a new Flask application instance for each test module.
+    A fixture that creates one Flask application instance for the test session.
     It uses the 'testing' configuration.
     """
     # 1. Create the app using the 'testing' configuration
@@ -28,6 +30,16 @@ def app():
 
     # 2. Establish an application context
     with app.app_context():
+        # pysqlite's own transaction handling breaks SAVEPOINTs; let
+        # SQLAlchemy emit BEGIN itself so tests can roll back their writes
+        @event.listens_for(db.engine, "connect")
+        def disable_pysqlite_transactions(dbapi_connection, _record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(db.engine, "begin")
+        def emit_begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
         # 3. Create the database tables
         db.create_all()
 
@@ -39,7 +51,7 @@ def app():
         db.drop_all()
 
 
-@pytest.fixture(scope="module")
+@pytest.fixture(scope="session")
 def client(app):
     """
     A fixture that provides a test client for the application.
@@ -54,3 +66,27 @@ def client(app):
     # Create and yield the test client
     with app.test_client() as client:
         yield client
+
+
+@pytest.fixture(autouse=True)
+def db_transaction(app):
+    """
+    Runs each test inside a transaction that is rolled back afterwards, so the
+    session-wide database is back to its seeded state for the next test.
+    Commits made by the code under test only release a savepoint.
+    """
+    connection = db.engine.connect()
+    transaction = connection.begin()
+    app_session = db.session
+    db.session = scoped_session(
+        sessionmaker(bind=connection, join_transaction_mode="create_savepoint")
+    )
+
+    yield
+
+    db.session.remove()
+    db.session = app_session
+    transaction.rollback()
+    connection.close()
+    # Ids cached from rolled-back rows would point at nothing
+    app.extensions.pop("role_cache", None)
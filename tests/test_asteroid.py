@@ -0,0 +1,718 @@
+import io
+import json
+import socket
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock, PropertyMock
+
+import diskcache
+import numpy as np
+import pytest
+import requests
+
+from controllers.asteroid_controller import (
+    EARTH_RADIUS_KM,
+    TRANSIENT_FAILURE_TTL,
+    UPSTREAM_FAILURE_TTL,
+    _SESSION,
+    _coalesce,
+    _local_population,
+)
+from config import TestingConfig
+from extensions import cache, limiter
+from factory import create_app
+
+# =================================================================
+# Helpers
+# =================================================================
+
+
+def make_feed_payload():
+    """Builds a minimal NASA NEO feed payload with a single asteroid."""
+    return {
+        "near_earth_objects": {
+            "2025-10-05": [
+                {
+                    "id": "3542519",
+                    "name": "(2010 PK9)",
+                    "close_approach_data": [
+                        {"miss_distance": {"kilometers": "12345.678"}}
+                    ],
+                }
+            ]
+        }
+    }
+
+
+def mock_nasa_response(mocker, payload):
+    """Patches the outbound HTTP call with a successful NASA response."""
+    mock_response = MagicMock()
+    mock_response.__enter__.return_value = mock_response
+    mock_response.headers = {"content-type": "application/json"}
+    # The body is streamed, so every read gets a fresh stream
+    body = json.dumps(payload).encode()
+    type(mock_response).raw = PropertyMock(side_effect=lambda: io.BytesIO(body))
+    return mocker.patch(
+        "controllers.asteroid_controller._SESSION.get", return_value=mock_response
+    )
+
+
+def make_impact_payload():
+    """Builds a simulate-impact request for a circle around New York."""
+    return {
+        "location": {"lat": 40.7128, "lon": -74.006, "radius_km": 12},
+        "asteroid": {
+            "orbital_data": {"aphelion_distance": "1.5"},
+            "diameterMeters": 120,
+            "mass_kg": 2e9,
+            "relative_velocity_km_s": 17.5,
+        },
+    }
+
+
+def mock_geo_responses(mocker):
+    """Patches the outbound HTTP call with WorldPop and Nominatim responses."""
+
+    def mock_get(url, *args, **kwargs):
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        if "worldpop" in url:
+            body = {"data": {"total_population": 1000}}
+        else:
+            body = {"display_name": "New York"}
+        mock_response.content = json.dumps(body).encode()
+        return mock_response
+
+    return mocker.patch(
+        "controllers.asteroid_controller._SESSION.get", side_effect=mock_get
+    )
+
+
+class FakeRaster:
+    """
+    A north-up, single-band raster in memory with the parts of the rasterio
+    dataset API that _local_population uses.
+    """
+
+    def __init__(self, data, west, north, cell_deg, nodata=None):
+        self.data = data
+        self.transform = SimpleNamespace(a=cell_deg, c=west, e=-cell_deg, f=north)
+        self.nodata = nodata
+        self.height, self.width = data.shape
+        self.windows = []
+
+    def read(self, band, window):
+        """Reads a window that lies inside the raster."""
+        assert band == 1
+        (row_start, row_stop), (col_start, col_stop) = window
+        assert 0 <= row_start < row_stop <= self.height
+        assert 0 <= col_start < col_stop <= self.width
+        self.windows.append(window)
+        return self.data[row_start:row_stop, col_start:col_stop]
+
+
+def brute_force_population(raster, lat, lon, radius_km):
+    """Sums every valid raster cell whose centre is inside the circle."""
+    km_per_deg = np.pi * EARTH_RADIUS_KM / 180.0
+    cos_lat = np.cos(np.radians(lat))
+    transform = raster.transform
+    total = 0.0
+    for row, col in np.ndindex(raster.data.shape):
+        value = raster.data[row, col]
+        if value <= 0 or value == raster.nodata:
+            continue
+        y = transform.f + (row + 0.5) * transform.e
+        x = transform.c + (col + 0.5) * transform.a
+        dy = (y - lat) * km_per_deg
+        dx = (x - lon) * km_per_deg * cos_lat
+        if dx * dx + dy * dy <= radius_km * radius_km:
+            total += value
+    return total
+
+
+@pytest.fixture
+def worldpop_cache(mocker, tmp_path):
+    """Replaces the on-disk WorldPop cache with an empty temporary one."""
+    temp_cache = diskcache.Cache(str(tmp_path))
+    mocker.patch("controllers.asteroid_controller._WORLDPOP_CACHE", temp_cache)
+    yield temp_cache
+    temp_cache.close()
+
+
+# =================================================================
+# Tests for the /asteroid/feed endpoint
+# =================================================================
+
+
+def test_feed_success(client, mocker):
+    """
+    GIVEN a mocked NASA NEO feed
+    WHEN the '/asteroid/feed' endpoint is hit with a valid date
+    THEN check that the asteroids are flattened into id, name and distance
+    """
+    # Arrange
+    mock_nasa_response(mocker, make_feed_payload())
+
+    # Act
+    response = client.get("/asteroid/feed?start_date=2025-10-05")
+
+    # Assert
+    assert response.status_code == 200
+    asteroids = response.get_json()["asteroids"]
+    assert asteroids == [
+        {"id": "3542519", "name": "(2010 PK9)", "distance": "12345.678"}
+    ]
+
+
+def test_feed_failure_invalid_date(client, mocker):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/asteroid/feed' endpoint is hit with a malformed date
+    THEN check that it is rejected by validation without calling NASA
+    """
+    # Arrange
+    mock_requests_get = mock_nasa_response(mocker, make_feed_payload())
+
+    # Act
+    response = client.get("/asteroid/feed?start_date=05-10-2025")
+
+    # Assert
+    assert response.status_code == 422
+    assert response.get_json()[0]["loc"] == ["start_date"]
+    mock_requests_get.assert_not_called()
+
+
+@pytest.mark.parametrize("start_date", ["0", "20251005", "2025-10-05T00:00:00"])
+def test_feed_failure_non_iso_date(client, mocker, start_date):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/asteroid/feed' endpoint is hit with a number, a compact date or
+        a datetime that pydantic would otherwise coerce
+    THEN check that it is rejected by validation without calling NASA
+    """
+    # Arrange
+    mock_requests_get = mock_nasa_response(mocker, make_feed_payload())
+
+    # Act
+    response = client.get(f"/asteroid/feed?start_date={start_date}")
+
+    # Assert
+    assert response.status_code == 422
+    assert response.get_json()[0]["loc"] == ["start_date"]
+    mock_requests_get.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "query, message",
+    [
+        ("end_date=2025-10-05", "end_date requires start_date"),
+        (
+            "start_date=2025-10-05&end_date=2025-10-04",
+            "end_date cannot be before start_date.",
+        ),
+    ],
+)
+def test_feed_failure_invalid_date_range(client, mocker, query, message):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/asteroid/feed' endpoint is hit with an end_date but no
+        start_date, or with an end_date before the start_date
+    THEN check that it is rejected by validation without calling NASA
+    """
+    # Arrange
+    mock_requests_get = mock_nasa_response(mocker, make_feed_payload())
+
+    # Act
+    response = client.get(f"/asteroid/feed?{query}")
+
+    # Assert
+    assert response.status_code == 422
+    assert message in response.get_json()[0]["msg"]
+    mock_requests_get.assert_not_called()
+
+
+def test_feed_failure_non_json_upstream(client, mocker):
+    """
+    GIVEN a NASA response that is not JSON (e.g. an HTML error page)
+    WHEN the '/asteroid/feed' endpoint is hit
+    THEN check that a 502 Bad Gateway error is returned
+    """
+    # Arrange
+    mock_session_get = mock_nasa_response(mocker, make_feed_payload())
+    mock_session_get.return_value.headers = {"content-type": "text/html"}
+
+    # Act
+    response = client.get("/asteroid/feed?start_date=2025-10-05")
+
+    # Assert
+    assert response.status_code == 502
+    assert response.get_json()["message"] == "Invalid JSON from upstream"
+
+
+def test_feed_conditional_get_returns_not_modified(client, mocker):
+    """
+    GIVEN a feed response carrying an ETag
+    WHEN the same feed is requested again with a matching If-None-Match
+    THEN check that a 304 Not Modified without a body is returned
+    """
+    # Arrange
+    mock_nasa_response(mocker, make_feed_payload())
+    first = client.get("/asteroid/feed?start_date=2025-10-05")
+    etag = first.headers["ETag"]
+
+    # Act
+    response = client.get(
+        "/asteroid/feed?start_date=2025-10-05", headers={"If-None-Match": etag}
+    )
+
+    # Assert
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "public, max-age=86400"
+    assert response.status_code == 304
+    assert response.data == b""
+
+
+def test_feed_is_cached_per_date_range(app, client, mocker):
+    """
+    GIVEN a real (in-memory) cache backend
+    WHEN the '/asteroid/feed' endpoint is hit twice for the same date range
+    THEN check that NASA is only called once
+    """
+    # Arrange: The testing config uses NullCache, so swap in a SimpleCache
+    cache.init_app(app, config={"CACHE_TYPE": "SimpleCache"})
+    mock_requests_get = mock_nasa_response(mocker, make_feed_payload())
+
+    try:
+        # Act
+        first = client.get("/asteroid/feed?start_date=2025-10-01")
+        second = client.get("/asteroid/feed?start_date=2025-10-01")
+    finally:
+        cache.clear()
+        cache.init_app(app)
+
+    # Assert
+    assert first.status_code == 200
+    assert second.get_json() == first.get_json()
+    mock_requests_get.assert_called_once()
+
+
+def test_feed_works_when_cache_backend_is_down(app, client, mocker):
+    """
+    GIVEN a Redis cache backend that cannot be reached
+    WHEN the '/asteroid/feed' endpoint is hit
+    THEN check that the feed is still fetched from NASA and returned
+    """
+    # Arrange
+    cache.init_app(
+        app,
+        config={"CACHE_TYPE": "RedisCache", "CACHE_REDIS_URL": "redis://127.0.0.1:1/0"},
+    )
+    mock_requests_get = mock_nasa_response(mocker, make_feed_payload())
+
+    try:
+        # Act
+        response = client.get("/asteroid/feed?start_date=2025-10-03")
+    finally:
+        cache.init_app(app)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.get_json()["asteroids"][0]["id"] == "3542519"
+    mock_requests_get.assert_called_once()
+
+
+def test_feed_works_when_rate_limit_storage_is_down(app, mocker):
+    """
+    GIVEN rate limiting enabled with its storage on a Redis that is down
+    WHEN the '/asteroid/feed' endpoint is hit
+    THEN check that the request is still served
+    """
+    # Arrange: the limiter is a shared extension, so build a separate app
+    mocker.patch.object(TestingConfig, "RATELIMIT_ENABLED", True)
+    mocker.patch.object(
+        TestingConfig, "RATELIMIT_STORAGE_URI", "redis://127.0.0.1:1/0"
+    )
+    limited_app = create_app(config_name="testing")
+    mock_nasa_response(mocker, make_feed_payload())
+
+    try:
+        # Act
+        response = limited_app.test_client().get(
+            "/asteroid/feed?start_date=2025-10-04"
+        )
+    finally:
+        # Hand the limiter back to the (unlimited) session app
+        limiter.init_app(app)
+
+    # Assert
+    assert response.status_code == 200
+
+
+def test_feed_serves_stale_copy_when_upstream_fails(app, client, mocker):
+    """
+    GIVEN a cached feed that is past its fresh TTL
+    WHEN NASA fails while the same feed is requested again
+    THEN check that the stale copy is served with a Warning header
+    """
+    # Arrange
+    cache.init_app(app, config={"CACHE_TYPE": "SimpleCache"})
+    mocker.patch("controllers.asteroid_controller.FEED_PAST_TTL", 0)
+    mock_session_get = mock_nasa_response(mocker, make_feed_payload())
+
+    try:
+        first = client.get("/asteroid/feed?start_date=2025-10-02")
+        mock_session_get.side_effect = requests.exceptions.ConnectionError
+
+        # Act
+        response = client.get("/asteroid/feed?start_date=2025-10-02")
+    finally:
+        cache.clear()
+        cache.init_app(app)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.get_json() == first.get_json()
+    assert response.headers["Warning"] == '110 - "Response is Stale"'
+    assert "Warning" not in first.headers
+
+
+def test_coalesce_shares_one_call_between_concurrent_callers():
+    """
+    GIVEN a slow upstream call that is still in flight
+    WHEN a second caller asks for the same key
+    THEN check that it waits for and shares the first call's result
+    """
+    # Arrange
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_fetch(value):
+        calls.append(value)
+        started.set()
+        release.wait(timeout=5)
+        return value * 2
+
+    results = []
+    first = threading.Thread(
+        target=lambda: results.append(_coalesce("key", slow_fetch, 21))
+    )
+    second = threading.Thread(
+        target=lambda: results.append(_coalesce("key", slow_fetch, 21))
+    )
+
+    # Act
+    first.start()
+    started.wait(timeout=5)
+    second.start()
+    # Give the second caller time to attach to the in-flight call
+    time.sleep(0.2)
+    release.set()
+    first.join(timeout=5)
+    second.join(timeout=5)
+
+    # Assert
+    assert results == [42, 42]
+    assert calls == [21]
+
+
+def test_session_does_not_retry_read_timeouts():
+    """
+    GIVEN an upstream that accepts connections but never answers
+    WHEN the shared session calls it with a short timeout
+    THEN check that the read timeout is raised after a single attempt
+    """
+    # Arrange
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(8)
+    server.settimeout(0.1)
+    url = f"http://127.0.0.1:{server.getsockname()[1]}/"
+    accepted = []
+
+    # Act
+    try:
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            _SESSION.get(url, timeout=0.2)
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except socket.timeout:
+                break
+    finally:
+        for connection in accepted:
+            connection.close()
+        server.close()
+
+    # Assert
+    assert len(accepted) == 1
+
+
+# =================================================================
+# Tests for the local population raster
+# =================================================================
+
+
+def test_local_population_sums_cells_inside_circle():
+    """
+    GIVEN a 20x20 raster of 0.01 degree cells with one nodata cell
+    WHEN the population of a circle in the middle of it is summed
+    THEN check that exactly the valid cells whose centre is inside are counted
+    """
+    # Arrange: distinct values so a shifted window changes the sum
+    data = np.arange(1, 401, dtype=np.float64).reshape(20, 20)
+    data[10, 10] = -99.0
+    raster = FakeRaster(data, west=0.0, north=0.2, cell_deg=0.01, nodata=-99.0)
+    lat, lon, radius_km = 0.1, 0.1, 3.0
+
+    # Act
+    population = _local_population(raster, lat, lon, radius_km)
+
+    # Assert
+    expected = brute_force_population(raster, lat, lon, radius_km)
+    assert population == pytest.approx(expected)
+    # The window only covers the circle's bounding box, not the whole raster
+    (row_start, row_stop), (col_start, col_stop) = raster.windows[0]
+    assert 0 < row_start < row_stop < 20
+    assert 0 < col_start < col_stop < 20
+
+
+def test_local_population_small_circle_counts_one_cell():
+    """
+    GIVEN a raster of 0.01 degree (~1.1 km) cells
+    WHEN a 0.3 km circle centred on one cell is summed
+    THEN check that only that cell's value is returned
+    """
+    # Arrange
+    data = np.arange(1, 101, dtype=np.float64).reshape(10, 10)
+    raster = FakeRaster(data, west=0.0, north=0.1, cell_deg=0.01)
+
+    # Act: centre of row 3, column 7
+    population = _local_population(raster, 0.065, 0.075, 0.3)
+
+    # Assert
+    assert population == data[3, 7]
+
+
+@pytest.mark.parametrize(
+    "lat, lon",
+    [
+        (0.1, 0.0),  # centred on the north-west corner
+        (0.05, 0.099),  # reaching over the east edge
+        (0.5, 0.5),  # wholly outside
+    ],
+)
+def test_local_population_circle_not_covered_by_raster(lat, lon):
+    """
+    GIVEN a circle partly or wholly outside the raster's extent
+    WHEN its population is summed
+    THEN check that None is returned without reading the raster, so the
+        caller falls back to WorldPop instead of undercounting
+    """
+    # Arrange
+    data = np.arange(1, 101, dtype=np.float64).reshape(10, 10)
+    raster = FakeRaster(data, west=0.0, north=0.1, cell_deg=0.01)
+
+    # Act
+    population = _local_population(raster, lat, lon, 2.5)
+
+    # Assert
+    assert population is None
+    assert raster.windows == []
+
+
+# =================================================================
+# Tests for the /asteroid/simulate-impact endpoint
+# =================================================================
+
+
+def test_simulate_impact_success(client, mocker, worldpop_cache):
+    """
+    GIVEN mocked WorldPop and Nominatim services
+    WHEN the '/asteroid/simulate-impact' endpoint is posted a location
+    THEN check that population, place and impact effects are returned
+    """
+    # Arrange
+    mock_geo_responses(mocker)
+
+    # Act
+    response = client.post("/asteroid/simulate-impact", json=make_impact_payload())
+
+    # Assert
+    assert response.status_code == 200
+    response_data = response.get_json()
+    assert response_data["population"] == 1000
+    assert response_data["place"] == "New York"
+    assert response_data["lethality_used"] == 0.99
+    assert response_data["estimated_kills"] == 990
+
+
+def test_simulate_impact_outside_local_raster_asks_worldpop(
+    app, client, mocker, worldpop_cache
+):
+    """
+    GIVEN a local raster that does not cover the impact location
+    WHEN the '/asteroid/simulate-impact' endpoint is posted a small circle
+    THEN check that the population comes from WorldPop, not the raster
+    """
+    # Arrange
+    mock_requests_get = mock_geo_responses(mocker)
+    data = np.ones((10, 10))
+    raster = FakeRaster(data, west=0.0, north=0.1, cell_deg=0.01)
+    mocker.patch.dict(app.extensions, {"wp_raster": raster})
+    payload = make_impact_payload()
+    payload["location"]["radius_km"] = 0.5
+
+    # Act
+    response = client.post("/asteroid/simulate-impact", json=payload)
+
+    # Assert
+    assert response.status_code == 200
+    assert response.get_json()["population"] == 1000
+    assert raster.windows == []
+    assert any(
+        "worldpop" in call.args[0] for call in mock_requests_get.call_args_list
+    )
+
+
+def test_simulate_impact_accepts_json_sent_as_text_plain(
+    client, mocker, worldpop_cache
+):
+    """
+    GIVEN a JSON impact request sent with a text/plain Content-Type
+    WHEN the '/asteroid/simulate-impact' endpoint is posted to
+    THEN check that the body is still parsed and validated as JSON
+    """
+    # Arrange
+    mock_geo_responses(mocker)
+
+    # Act
+    response = client.post(
+        "/asteroid/simulate-impact",
+        data=json.dumps(make_impact_payload()),
+        content_type="text/plain",
+    )
+
+    # Assert
+    assert response.status_code == 200
+    assert response.get_json()["population"] == 1000
+
+
+def test_simulate_impact_reuses_cached_lookups(client, mocker, worldpop_cache):
+    """
+    GIVEN mocked WorldPop and Nominatim services
+    WHEN the same impact is simulated twice
+    THEN check that the upstream services are only called for the first one
+    """
+    # Arrange
+    mock_session_get = mock_geo_responses(mocker)
+
+    # Act
+    first = client.post("/asteroid/simulate-impact", json=make_impact_payload())
+    second = client.post("/asteroid/simulate-impact", json=make_impact_payload())
+
+    # Assert: one WorldPop call plus one Nominatim call in total
+    assert first.status_code == second.status_code == 200
+    assert second.get_json() == first.get_json()
+    assert mock_session_get.call_count == 2
+
+
+def test_simulate_impact_snaps_nearby_locations(client, mocker, worldpop_cache):
+    """
+    GIVEN two locations that differ only beyond the 4th decimal
+    WHEN an impact is simulated at each of them
+    THEN check that both snap to the same point and share one WorldPop lookup
+    """
+    # Arrange
+    mock_session_get = mock_geo_responses(mocker)
+    first_payload = make_impact_payload()
+    first_payload["location"]["lat"] = 40.712801
+    second_payload = make_impact_payload()
+    second_payload["location"]["lat"] = 40.712799
+
+    # Act
+    first = client.post("/asteroid/simulate-impact", json=first_payload)
+    second = client.post("/asteroid/simulate-impact", json=second_payload)
+
+    # Assert
+    assert first.get_json()["snapped_location"]["lat"] == 40.7128
+    assert second.get_json()["snapped_location"]["lat"] == 40.7128
+    assert mock_session_get.call_count == 2
+
+
+def test_simulate_impact_remembers_upstream_failures(client, mocker, worldpop_cache):
+    """
+    GIVEN a WorldPop service that is failing
+    WHEN the same impact is simulated twice
+    THEN check that both fail but WorldPop is only called for the first one
+    """
+    # Arrange
+    mock_session_get = mock_geo_responses(mocker)
+    worldpop_down = MagicMock(status_code=500, text="Internal Server Error")
+    mock_session_get.side_effect = lambda url, *args, **kwargs: (
+        worldpop_down if "worldpop" in url else MagicMock(status_code=404)
+    )
+
+    # Act
+    first = client.post("/asteroid/simulate-impact", json=make_impact_payload())
+    second = client.post("/asteroid/simulate-impact", json=make_impact_payload())
+
+    # Assert
+    worldpop_calls = [
+        c for c in mock_session_get.call_args_list if "worldpop" in c.args[0]
+    ]
+    assert first.status_code == second.status_code == 502
+    assert second.get_json() == first.get_json()
+    assert len(worldpop_calls) == 1
+
+
+@pytest.mark.parametrize(
+    "worldpop_status, failure_ttl",
+    [(503, TRANSIENT_FAILURE_TTL), (400, UPSTREAM_FAILURE_TTL)],
+)
+def test_simulate_impact_caches_transient_failures_briefly(
+    client, mocker, worldpop_cache, worldpop_status, failure_ttl
+):
+    """
+    GIVEN a WorldPop service answering with a server or a client error
+    WHEN an impact is simulated
+    THEN check that a server error is remembered only briefly and a client
+        error for the long failure TTL
+    """
+    # Arrange
+    mock_session_get = mock_geo_responses(mocker)
+    worldpop_error = MagicMock(status_code=worldpop_status, text="error")
+    mock_session_get.side_effect = lambda url, *args, **kwargs: (
+        worldpop_error if "worldpop" in url else MagicMock(status_code=404)
+    )
+
+    # Act
+    before = time.time()
+    response = client.post("/asteroid/simulate-impact", json=make_impact_payload())
+
+    # Assert
+    failure_keys = [k for k in worldpop_cache.iterkeys() if k.endswith(":failure")]
+    _value, expire_time = worldpop_cache.get(failure_keys[0], expire_time=True)
+    assert response.status_code == 502
+    assert len(failure_keys) == 1
+    assert before + failure_ttl <= expire_time <= time.time() + failure_ttl
+
+
+def test_simulate_impact_failure_missing_area(client, mocker):
+    """
+    GIVEN an impact request with neither a location nor a GeoJSON area
+    WHEN the '/asteroid/simulate-impact' endpoint is posted to
+    THEN check that it is rejected by validation without calling upstream
+    """
+    # Arrange
+    mock_session_get = mock_geo_responses(mocker)
+    payload = make_impact_payload()
+    del payload["location"]
+
+    # Act
+    response = client.post("/asteroid/simulate-impact", json=payload)
+
+    # Assert
+    assert response.status_code == 422
+    mock_session_get.assert_not_called()
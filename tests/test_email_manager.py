@@ -0,0 +1,99 @@
+from email import message_from_bytes, policy
+
+from utils.email_manager import _build_message
+
+# =================================================================
+# Tests for EmailManager template rendering
+# =================================================================
+
+
+def test_render_compiles_each_template_once(app, mocker):
+    """
+    GIVEN the app's EmailManager
+    WHEN the same email template is rendered twice with different values
+    THEN check that Jinja is asked for the template only once
+    """
+    # Arrange
+    email_manager = app.email_manager
+    email_manager._templates.clear()
+    get_template = mocker.spy(app.jinja_env, "get_template")
+
+    # Act
+    first = email_manager.render(
+        "emails/change_password.txt", name="Ana", link="https://a.example/1"
+    )
+    second = email_manager.render(
+        "emails/change_password.txt", name="Bia", link="https://a.example/2"
+    )
+
+    # Assert
+    assert first.startswith("Olá, Ana,")
+    assert "https://a.example/2" in second
+    get_template.assert_called_once_with("emails/change_password.txt")
+
+
+# =================================================================
+# Tests for building raw messages
+# =================================================================
+
+
+def test_build_message_text_only():
+    """
+    GIVEN a plain-text email with a non-ASCII subject and sender name
+    WHEN the raw message is built and parsed back with the stdlib parser
+    THEN check that it is a single text/plain part with decoded headers
+    """
+    # Arrange
+    text = "Olá, Ana!\nSeu código é 123.\n"
+
+    # Act
+    raw = _build_message(
+        "Equipe Início <noreply@example.com>", "ana@example.com", "Confirmação", text
+    )
+    message = message_from_bytes(raw, policy=policy.default)
+
+    # Assert
+    assert message.get_all("MIME-Version") == ["1.0"]
+    assert message["From"].addresses[0].display_name == "Equipe Início"
+    assert message["From"].addresses[0].addr_spec == "noreply@example.com"
+    assert message["To"] == "ana@example.com"
+    assert message["Subject"] == "Confirmação"
+    assert message.get_content_type() == "text/plain"
+    assert message.get_content() == text
+    assert not message.defects
+
+
+def test_build_message_multipart_with_html():
+    """
+    GIVEN an email with plain-text and HTML bodies and a non-ASCII subject
+    WHEN the raw message is built and parsed back with the stdlib parser
+    THEN check the multipart/alternative framing, boundary and decoded parts
+    """
+    # Arrange
+    text = "Olá, Ana!\n"
+    html = "<p>Olá, <b>Ana</b>!</p>"
+
+    # Act
+    raw = _build_message(
+        "Equipe Início <noreply@example.com>",
+        "ana@example.com",
+        "Confirme seu e-mail ✓\r\nBcc: intruder@example.com",
+        text,
+        html,
+    )
+    message = message_from_bytes(raw, policy=policy.default)
+
+    # Assert
+    parts = list(message.iter_parts())
+    boundary = message.get_boundary()
+    assert message.get_all("MIME-Version") == ["1.0"]
+    assert message["From"].addresses[0].display_name == "Equipe Início"
+    assert message["Subject"] == "Confirme seu e-mail ✓ Bcc: intruder@example.com"
+    assert message["Bcc"] is None
+    assert message.get_content_type() == "multipart/alternative"
+    assert raw.endswith(f"--{boundary}--\r\n".encode())
+    assert [part.get_content_type() for part in parts] == ["text/plain", "text/html"]
+    assert parts[0].get_content() == text
+    assert parts[1].get_content() == html
+    assert not message.defects
+    assert not any(part.defects for part in parts)
@@ -0,0 +1,42 @@
+import decimal
+import uuid
+from datetime import date, datetime, timezone
+
+from flask.json.provider import DefaultJSONProvider
+
+# =================================================================
+# Tests for the orjson-backed JSON provider
+# =================================================================
+
+
+def test_dumps_matches_flask_default_provider(app):
+    """
+    GIVEN a payload with dates, datetimes, decimals, UUIDs and unsorted keys
+    WHEN it is serialized by the app's provider and by Flask's default one
+    THEN check that both produce the same JSON
+    """
+    # Arrange
+    payload = {
+        "zeta": 1,
+        "alpha": {
+            "created_at": datetime(2025, 10, 5, 12, 30, tzinfo=timezone.utc),
+            "birthday": date(1990, 1, 2),
+        },
+        "amount": decimal.Decimal("1.50"),
+        "id": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    }
+
+    # Act
+    ours = app.json.loads(app.json.dumps(payload))
+    flasks = DefaultJSONProvider(app)
+    expected = flasks.loads(flasks.dumps(payload))
+
+    # Assert
+    assert ours == expected
+    assert ours["alpha"]["created_at"] == "Sun, 05 Oct 2025 12:30:00 GMT"
+    assert list(app.json.loads(app.json.response(payload).data)) == [
+        "alpha",
+        "amount",
+        "id",
+        "zeta",
+    ]
@@ -0,0 +1,196 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event, inspect
+from werkzeug.security import generate_password_hash
+
+from factory import db, password_hash_method
+from models.user import Permission, Role, User
+
+# =================================================================
+# Tests for password hashing
+# =================================================================
+
+
+def test_verify_password_upgrades_outdated_hash(app):
+    """
+    GIVEN a stored user whose password was hashed with an older method
+    WHEN the correct password is verified
+    THEN check that the hash is redone with the configured method and saved
+    """
+    # Arrange
+    user = User(email="rehash@example.com", first_name="Old", last_name="Hash")
+    user.password_hash = generate_password_hash("secret", method="pbkdf2:sha256:2")
+    db.session.add(user)
+    db.session.commit()
+
+    # Act
+    verified = user.verify_password("secret")
+
+    # Assert: the upgraded hash was committed, not just left in the session
+    db.session.expunge_all()
+    stored = User.query.filter_by(email="rehash@example.com").one()
+    assert verified
+    assert stored.password_hash.startswith(app.config["PASSWORD_HASH_METHOD"] + "$")
+    assert stored.verify_password("secret")
+    assert not stored.verify_password("wrong")
+
+
+def test_verify_password_keeps_hash_for_short_method_spelling(app, mocker):
+    """
+    GIVEN PASSWORD_HASH_METHOD configured with werkzeug's short "scrypt" name
+    WHEN a password hashed with that method is verified
+    THEN check that the hash is not redone
+    """
+    # Arrange
+    mocker.patch.dict(
+        app.config, {"PASSWORD_HASH_METHOD": password_hash_method("scrypt")}
+    )
+    user = User(email="current@example.com", first_name="Cur", last_name="Rent")
+    user.password_hash = generate_password_hash("secret", method="scrypt")
+    original_hash = user.password_hash
+
+    # Act
+    verified = user.verify_password("secret")
+
+    # Assert
+    assert verified
+    assert user.password_hash == original_hash
+
+
+# =================================================================
+# Tests for role assignment
+# =================================================================
+
+
+def test_new_users_get_cached_role_ids(app, mocker):
+    """
+    GIVEN the default roles in the database and a configured admin address
+    WHEN an admin (in different letter case) and a regular user are created
+    THEN check that they get the admin and default role ids from the cache
+    """
+    # Arrange
+    Role.insert_roles()
+    mocker.patch.dict(app.config, {"ADMINS": frozenset({"admin@example.com"})})
+
+    # Act
+    admin = User(email="Admin@Example.com", first_name="Ad", last_name="Min")
+    regular = User(email="regular@example.com", first_name="Reg", last_name="Ular")
+
+    # Assert
+    role_ids = app.extensions["role_cache"]
+    assert admin.role_id == role_ids["admin"]
+    assert regular.role_id == role_ids["default"]
+    assert db.session.get(Role, regular.role_id).name == "User"
+    assert admin.can(Permission.ADMINISTER)
+    assert regular.can(Permission.ACTION_1)
+    assert not regular.can(Permission.ACTION_1 | Permission.MODERATE)
+
+
+def test_placeholder_email_is_not_admin_without_configured_admins(app, mocker):
+    """
+    GIVEN no ADMINS or ADMIN_EMAIL configured
+    WHEN a user registers with the placeholder admin address
+    THEN check that the user gets the default role
+    """
+    # Arrange
+    Role.insert_roles()
+    mocker.patch.dict(app.config, {"ADMINS": frozenset()})
+
+    # Act
+    user = User(email=app.config["EMAIL"], first_name="Not", last_name="Admin")
+
+    # Assert
+    assert user.role_id == app.extensions["role_cache"]["default"]
+    assert not user.can(Permission.ADMINISTER)
+
+
+# =================================================================
+# Tests for activity tracking
+# =================================================================
+
+
+def test_ping_throttles_last_seen_writes(app):
+    """
+    GIVEN a user last seen an hour ago
+    WHEN the user is pinged twice in a row
+    THEN check that last_seen is written once and the second ping is skipped
+    """
+    # Arrange
+    an_hour_ago = datetime.now(timezone.utc) - timedelta(hours=1)
+    user = User(email="ping@example.com", first_name="Ping", last_seen=an_hour_ago)
+    db.session.add(user)
+    db.session.commit()
+
+    # Act
+    user.ping()
+    first_seen = user.last_seen
+    user.ping()
+
+    # Assert
+    assert first_seen.replace(tzinfo=timezone.utc) > an_hour_ago
+    assert user.last_seen == first_seen
+
+
+# =================================================================
+# Tests for serialization
+# =================================================================
+
+
+def test_to_dict_does_not_load_image_bytes(app):
+    """
+    GIVEN a stored user with profile images
+    WHEN the user is loaded fresh and serialized with to_dict
+    THEN check that neither image blob is loaded from the database
+    """
+    # Arrange
+    user = User(email="images@example.com", first_name="Img", last_name="Bytes")
+    user.profile_image_bytes = b"thumb"
+    user.original_profile_image_bytes = b"original"
+    db.session.add(user)
+    db.session.commit()
+    db.session.expunge_all()
+    user = User.query.filter_by(email="images@example.com").one()
+
+    # Act
+    user_dict = user.to_dict()
+
+    # Assert
+    unloaded = inspect(user).unloaded
+    assert user_dict["image"].endswith(f"/image/user_profile/{user.id}")
+    assert "profile_image_bytes" in unloaded
+    assert "original_profile_image_bytes" in unloaded
+
+
+def test_to_detail_dict_loads_deferred_groups_in_one_query(app):
+    """
+    GIVEN a stored user with personal and location data
+    WHEN the user is loaded fresh and serialized with to_detail_dict
+    THEN check that both deferred groups are fetched with a single SELECT
+    """
+    # Arrange
+    user = User(email="detail@example.com", first_name="De", last_name="Tail")
+    user.gender = "other"
+    user.last_city = "Recife"
+    db.session.add(user)
+    db.session.commit()
+    db.session.expunge_all()
+    user = User.query.filter_by(email="detail@example.com").one()
+    statements = []
+
+    def count_statement(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", count_statement)
+
+    # Act
+    try:
+        user_dict = user.to_detail_dict()
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count_statement)
+
+    # Assert
+    assert user_dict["fullname"] == "De Tail"
+    assert user_dict["gender"] == "other"
+    assert user_dict["last_city"] == "Recife"
+    assert len(statements) == 1
+    assert "original_profile_image_bytes" in inspect(user).unloaded
@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+
+from flask import has_request_context, request
+
+
+def utcnow():
+    """
+    The current UTC time, read once per request.
+
+    Every call inside the same request returns the same timestamp; outside a
+    request (CLI commands, background threads) it is read fresh each time.
+    """
+    if not has_request_context():
+        return datetime.now(timezone.utc)
+
+    # Kept in the WSGI environ rather than g: an app context pushed around
+    # several requests (as in the tests) would share g between them
+    now = request.environ.get("asteroid.request_now")
+    if now is None:
+        now = request.environ["asteroid.request_now"] = datetime.now(timezone.utc)
+    return now
@@ -1,12 +1,72 @@
-import base64
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
+from email.utils import formataddr, parseaddr
 
+import pybase64
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 
+def _header(value):
+    """A header value with line breaks removed, RFC 2047 encoded if not ASCII."""
+    value = " ".join(str(value).splitlines())
+    if value.isascii():
+        return value
+    return Header(value, "utf-8").encode()
+
+
+def _address(value):
+    """An address header value, encoding only the display name if needed."""
+    name, address = parseaddr(" ".join(str(value).splitlines()))
+    return formataddr((name, address), charset="utf-8")
+
+
+def _text_part(text, subtype):
+    """
+    A base64-encoded UTF-8 text/<subtype> MIME part. MIME-Version is left to
+    the message headers, which this part is either appended to or nested in.
+    """
+    return (
+        f"Content-Type: text/{subtype}; charset=\"utf-8\"\r\n"
+        "Content-Transfer-Encoding: base64\r\n"
+        "\r\n"
+    ).encode() + pybase64.encodebytes(text.encode()).replace(b"\n", b"\r\n")
+
+
+def _build_message(sender, to, subject, text, html=None):
+    """
+    Assembles an RFC 822 message as bytes.
+
+    Equivalent to a MIMEMultipart("alternative") with plain (and optional
+    HTML) MIMEText parts, without going through the email package.
+    """
+    headers = (
+        f"From: {_address(sender)}\r\n"
+        f"To: {_address(to)}\r\n"
+        f"Subject: {_header(subject)}\r\n"
+        "MIME-Version: 1.0\r\n"
+    )
+    if not html:
+        return headers.encode() + _text_part(text, "plain")
+
+    boundary = f"==============={uuid.uuid4().hex}=="
+    delimiter = f"--{boundary}\r\n".encode()
+    return (
+        (
+            headers
+            + f'Content-Type: multipart/alternative; boundary="{boundary}"\r\n'
+            + "\r\n"
+        ).encode()
+        + delimiter
+        + _text_part(text, "plain")
+        + delimiter
+        + _text_part(html, "html")
+        + f"--{boundary}--\r\n".encode()
+    )
+
+
 class _DummyGmailService:
     """A dummy service that mimics the Gmail API but does nothing.
 
@@ -37,6 +97,10 @@ class EmailManager:
         self.app = app
         self.service_gmail = None
         self.is_enabled = app.config.get("EMAIL_ENABLED", False)
+        self._templates = {}
+        # The Gmail client's HTTP transport isn't thread-safe, so background
+        # sends go through a single worker
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="email")
 
         # Initialize the real service only if enabled in the config
         if self.is_enabled:
@@ -71,27 +135,37 @@ class EmailManager:
             print("WARNING: Falling back to dummy email service.")
             self.service_gmail = _DummyGmailService()
 
-    def send_email(self, to, subject, template, template_html=None):
+    def render(self, template_name, **context):
+        """Renders an email template, looking it up only on first use."""
+        template = self._templates.get(template_name)
+        if template is None:
+            template = self.app.jinja_env.get_template(template_name)
+            self._templates[template_name] = template
+        return template.render(**context)
+
+    def send_email(self, to, subject, template, template_html=None, asynchronous=False):
         """
         Constructs and sends an email using the configured Gmail service.
 
         If email sending is disabled, it will log the attempt to the console
-        instead of sending a real email.
+        instead of sending a real email. With ``asynchronous=True`` the Gmail
+        call runs in the background and 202 is returned right away.
         """
         sender_address = self.app.config.get("MAIL_SENDER")
 
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = subject
-        msg["From"] = sender_address
-        msg["To"] = to
-        msg.attach(MIMEText(template, "plain"))
+        message = _build_message(
+            sender_address, to, subject, template, template_html
+        )
+        body = {"raw": pybase64.urlsafe_b64encode(message).decode()}
 
-        if template_html:
-            msg.attach(MIMEText(template_html, "html"))
+        if asynchronous:
+            self._executor.submit(self._deliver, body)
+            return 202
 
-        raw = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-        body = {"raw": raw}
+        return self._deliver(body)
 
+    def _deliver(self, body):
+        """Sends an encoded message and returns the resulting HTTP status."""
         try:
             # The service_gmail object is either the real one or the dummy one
             self.service_gmail.users().messages().send(userId="me", body=body).execute()
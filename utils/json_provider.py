@@ -0,0 +1,48 @@
+import dataclasses
+import decimal
+import uuid
+from datetime import date
+
+import orjson
+from flask.json.provider import JSONProvider
+from werkzeug.http import http_date
+
+# Matches Flask's DefaultJSONProvider output: keys are sorted, and dates go
+# through _default instead of orjson's native ISO 8601 encoding
+_ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+)
+
+
+def _default(obj):
+    """
+    Serializes the types orjson leaves to us the way Flask's default provider
+    does, e.g. dates and datetimes as RFC 822 HTTP dates.
+    """
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, "__html__"):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class OrJSONProvider(JSONProvider):
+    """A Flask JSON provider backed by orjson's C encoder and decoder."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Builds the response from bytes, skipping the str round-trip."""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS),
+            mimetype="application/json",
+        )